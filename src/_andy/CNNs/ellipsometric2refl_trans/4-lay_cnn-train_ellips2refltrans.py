@@ -21,6 +21,8 @@ import datetime
 global date
 date = datetime.datetime.now()
 import h5py
+import data_reader as rdr
+import data_pipeline as dp
 import scipy.io as sio
 from contextlib import redirect_stdout
 import csv
@@ -51,69 +53,26 @@ def resc_delt(in_delt):
 #this follows the generator format :
 #[angle,materials,thickness,rp,rs,tp,ts,psi,delta]
 def readin_data(filename,nmat,nang,nlay,nwave):
-    f = h5py.File(filename,'r')
-    arrd = np.array(f.get('data'))
-    itl=0
-    ith=nang
-    theta = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nmat
-    ml1 = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nmat
-    ml2 = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nmat
-    ml3 = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nmat
-    ml4 = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nlay
-    th = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    rp = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    rs = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    tp = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    ts = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    psi = (arrd[:,itl:ith])
-    itl=ith
-    delta = (arrd[:,itl:])
-    f.close()
+    #lazy views of the dataset: rows are read from the file only when they are indexed (see data_reader.py)
+    #read as float32, the precision Keras trains in, to halve the memory of the splits
+    data = rdr.DataSet(filename,nmat,nang,nlay,nwave,dtype=np.float32)
+    theta = data.column('ang')
+    ml1 = data.mats(0)
+    ml2 = data.mats(1)
+    ml3 = data.mats(2)
+    ml4 = data.mats(3)
+    rp = data.column('rp')
+    rs = data.column('rs')
+    tp = data.column('tp')
+    ts = data.column('ts')
 
     #rescale the input data
     #usually just rescaling angles, thicknesses, psi and delta is OK
-    psi = resc_psi(psi)
-    delta = resc_delt(delta)
-    th = resc_th(th)
+    psi = data.column('psi',resc_psi)
+    delta = data.column('delta',resc_delt)
+    th = data.column('l',resc_th)
     return (ml1,ml2,ml3,ml4,th,theta,rp,rs,tp,ts,psi,delta)
 
-#split the input arrays for multiple independent training / validation sets
-def split_data(m1,m2,m3,m4,th,ang,rp,rs,tp,ts,psi,delta,mn,mx):
-    tr_m1=m1[mn:mx,:]
-    tr_m2=m2[mn:mx,:]
-    tr_m3=m3[mn:mx,:]
-    tr_m4=m4[mn:mx,:]
-    tr_th=th[mn:mx,:]
-    tr_ang=ang[mn:mx,:]
-    tr_p=psi[mn:mx,:]
-    tr_d=delta[mn:mx,:]
-    tr_rp=rp[mn:mx,:]
-    tr_rs=rs[mn:mx,:]
-    tr_tp=tp[mn:mx,:]
-    tr_ts=ts[mn:mx,:]
-    return (tr_m1,tr_m2,tr_m3,tr_m4,tr_th,tr_ang,tr_rp,tr_rs,tr_tp,tr_ts,tr_p,tr_d)
-
-
 #read in data from file with the readin_data fcn
 #you need to update the num_mat, ect.. variables with your choices from the generator program
 num_mat = 5
@@ -124,90 +83,19 @@ num_wave = 200
 
 #directort to save data
 dr = '/home/arl92/Documents/newdata/pd2rt/'
+#cache of the preprocessed sets (see tensor_cache.py), shared by all scripts reading the same dataset
+cache_dr = '/home/arl92/Documents/newdata/cache/'
 
 #ranges for the independent datasets, recommended most data in the training set
-#then split the data
 tr = 200000   #training
 va = tr+10000 #validation
 te = va+10000 #test
 
-(m1r,m2r,m3r,m4r,thr,angr,rpr,rsr,tpr,tsr,psir,deltar) = split_data(ml1,ml2,ml3,ml4,th,ang,rp,rs,tp,ts,psi,delta,0,tr)
-(m1v,m2v,m3v,m4v,thv,angv,rpv,rsv,tpv,tsv,psiv,deltav) = split_data(ml1,ml2,ml3,ml4,th,ang,rp,rs,tp,ts,psi,delta,tr,va)
-(m1e,m2e,m3e,m4e,the,ange,rpe,rse,tpee,tse,psie,deltae) = split_data(ml1,ml2,ml3,ml4,th,ang,rp,rs,tp,ts,psi,delta,va,te)
-
-#the spectra need to be reshaped from [spec(ang1),spec(ang2),...] to [spec;angle] 2-d matrix
-#this does not seem particularly efficent but it works
- tr_p = np.zeros((tr,num_wave,num_ang))
- tr_d = np.zeros((tr,num_wave,num_ang))
- p = np.transpose(psir)
- d = np.transpose(deltar)
- for i in range(tr):
-     tr_p[i,:,:] = np.transpose(np.reshape(p[:,i],(num_ang,num_wave)))
-     tr_d[i,:,:] = np.transpose(np.reshape(d[:,i],(num_ang,num_wave)))
-
- va_p = np.zeros((va-tr,num_wave,num_ang))
- va_d = np.zeros((va-tr,num_wave,num_ang))
- p = np.transpose(psiv)
- d = np.transpose(deltav)
- for i in range(va-tr):
-     va_p[i,:,:] = np.transpose(np.reshape(p[:,i],(num_ang,num_wave)))
-     va_d[i,:,:] = np.transpose(np.reshape(d[:,i],(num_ang,num_wave)))
-
- te_p = np.zeros((te-va,num_wave,num_ang))
- te_d = np.zeros((te-va,num_wave,num_ang))
- p = np.transpose(psie)
- d = np.transpose(deltae)
- for i in range(te-va):
-     te_p[i,:,:] = np.transpose(np.reshape(p[:,i],(num_ang,num_wave)))
-     te_d[i,:,:] = np.transpose(np.reshape(d[:,i],(num_ang,num_wave)))
-   
-tr_rp = np.zeros((tr,num_wave,num_ang))
-tr_rs = np.zeros((tr,num_wave,num_ang))
-p = np.transpose(rpr)
-d = np.transpose(rsr)
-for i in range(tr):
-    tr_rp[i,:,:] = np.transpose(np.reshape(p[:,i],(num_ang,num_wave)))
-    tr_rs[i,:,:] = np.transpose(np.reshape(d[:,i],(num_ang,num_wave)))
-
-va_rp = np.zeros((va-tr,num_wave,num_ang))
-va_rs = np.zeros((va-tr,num_wave,num_ang))
-p = np.transpose(rpv)
-d = np.transpose(rsv)
-for i in range(va-tr):
-    va_rp[i,:,:] = np.transpose(np.reshape(p[:,i],(num_ang,num_wave)))
-    va_rs[i,:,:] = np.transpose(np.reshape(d[:,i],(num_ang,num_wave)))
-
-te_rp = np.zeros((te-va,num_wave,num_ang))
-te_rs = np.zeros((te-va,num_wave,num_ang))
-p = np.transpose(rpe)
-d = np.transpose(rse)
-for i in range(te-va):
-    te_rp[i,:,:] = np.transpose(np.reshape(p[:,i],(num_ang,num_wave)))
-    te_rs[i,:,:] = np.transpose(np.reshape(d[:,i],(num_ang,num_wave)))
-    
-tr_tp = np.zeros((tr,num_wave,num_ang))
-tr_ts = np.zeros((tr,num_wave,num_ang))
-p = np.transpose(tpr)
-d = np.transpose(tsr)
-for i in range(tr):
-    tr_tp[i,:,:] = np.transpose(np.reshape(p[:,i],(num_ang,num_wave)))
-    tr_ts[i,:,:] = np.transpose(np.reshape(d[:,i],(num_ang,num_wave)))
-
-va_tp = np.zeros((va-tr,num_wave,num_ang))
-va_ts = np.zeros((va-tr,num_wave,num_ang))
-p = np.transpose(tpv)
-d = np.transpose(tsv)
-for i in range(va-tr):
-    va_tp[i,:,:] = np.transpose(np.reshape(p[:,i],(num_ang,num_wave)))
-    va_ts[i,:,:] = np.transpose(np.reshape(d[:,i],(num_ang,num_wave)))
-
-te_tp = np.zeros((te-va,num_wave,num_ang))
-te_ts = np.zeros((te-va,num_wave,num_ang))
-p = np.transpose(tpee)
-d = np.transpose(tse)
-for i in range(te-va):
-    te_tp[i,:,:] = np.transpose(np.reshape(p[:,i],(num_ang,num_wave)))
-    te_ts[i,:,:] = np.transpose(np.reshape(d[:,i],(num_ang,num_wave)))
+#the sets are streamed from the file in batches instead of being loaded, see data_pipeline.py
+#the first run rescales and reshapes each set to [spec;angle] 2-d matrices into the cache, later runs map the cache
+tr_seq = dp.BatchSequence([psi,delta],[rp,rs,tp,ts],num_ang,num_wave,0,tr,batch_size=128,shuffle=True,cache_dr=cache_dr)
+va_seq = dp.BatchSequence([psi,delta],[rp,rs,tp,ts],num_ang,num_wave,tr,va,batch_size=128,shuffle=False,cache_dr=cache_dr)
+te_seq = dp.BatchSequence([psi,delta],[rp,rs,tp,ts],num_ang,num_wave,va,te,batch_size=128,shuffle=False,cache_dr=cache_dr)
 
 
 
@@ -333,13 +221,15 @@ def fit_fcn(x):
     #fitting based on independent training and validation sets
     #the lr callback is necessary to decay the learning rate as a function of epoch
     #batch size can be tuned as necessary
-    history = model.fit([tr_p,tr_d],[rpr,rsr,tpr,tsr],epochs=leng,batch_size=128,verbose=2,validation_data = ([va_p,va_d],[rpv,rsv,tpv,tsv]),callbacks=[lr])
+    #the sequences shuffle the rows themselves, block by block, so the batch order must not be shuffled by keras
+    #batches are prefetched in a background thread (max_queue_size), overlapping the file reads with the training
+    history = model.fit(tr_seq,epochs=leng,verbose=2,validation_data = va_seq,callbacks=[lr],shuffle=False,max_queue_size=10)
 
     #save model for later uses
     model.save(modname)
 
     #evaluate and print stats on the model fit to the log file
-    (te_loss) = model.evaluate([te_p,te_d],[rpe,rse,tpee,tse])
+    (te_loss) = model.evaluate(te_seq)
     print(te_loss)
     
     #this can be uncommented to save a plot of the learning rate decay over training epoch
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#Disk cache of the preprocessed CNN inputs and targets
+#reading, rescaling and reshaping a split of a dataset is done once, the result is stored as a .npy file in the
+#cache folder and later runs map it into memory (np.load with mmap_mode) instead of reading the dataset again.
+#the name of an entry is a hash of
+#   the dataset file (its size, modification time and first and last MB)
+#   the quantity, layer and row range of the data_reader view
+#   the rescaling fcn of the view (its code and constants, so changing a rescaling constant gives a new entry)
+#   the layout (input tensor or rows) and type of the result
+#so a regenerated dataset or a new rescaling never reads a stale entry, old entries are simply not used anymore
+#
+#   te_p = cached_tensor(psi.rows(va,te),num_ang,num_wave,cache_dr)   #(n,num_wave,num_ang) float32
+#   the = cached_rows(th.rows(va,te),cache_dr)                        #(n,num_lay) float32
+
+import os
+import hashlib
+import numpy as np
+import data_reader as rdr
+
+#rows converted at a time when an entry is written
+chunk_rows = 8192
+
+#fingerprints already computed in this process, by (filename, size, modification time)
+file_hashes = {}
+
+
+#fingerprint of a dataset file, reads 2 MB whatever the size of the file
+def file_hash(filename, probe=1<<20):
+    st = os.stat(filename)
+    key = (os.path.abspath(filename),st.st_size,st.st_mtime_ns)
+    if key not in file_hashes:
+        h = hashlib.sha1(('%d %d'%(st.st_size,st.st_mtime_ns)).encode())
+        with open(filename,'rb') as f:
+            h.update(f.read(probe))
+            f.seek(max(0,st.st_size-probe))
+            h.update(f.read(probe))
+        file_hashes[key] = h.hexdigest()
+    return file_hashes[key]
+
+
+#identifier of a rescaling fcn, changes with its code or its constants
+def transform_hash(fn):
+    if fn is None:
+        return 'none'
+    code = fn.__code__
+    return hashlib.sha1(code.co_code+repr(code.co_consts).encode()).hexdigest()
+
+
+#cache file of a view in the layout kind ('tensor' or 'rows') and type dtype
+def cache_file(cache_dr, col, kind, dtype):
+    data = col.data
+    parts = [file_hash(data.filename),col.name,str(col.layer),str(data.start),str(data.stop),
+             np.dtype(data.dtype).str,transform_hash(col.transform),kind,np.dtype(dtype).str]
+    key = hashlib.sha1('|'.join(parts).encode()).hexdigest()
+    return os.path.join(cache_dr,'%s_%s.npy'%(col.name,key[:20]))
+
+
+#read-only memory map of a view, written to the cache first if it is not there
+#kind = 'tensor' gives spectra as (n,nwave,nang) tensors (see data_reader.spectra_tensor), 'rows' the rows as read
+def cached(col, cache_dr, kind='rows', nang=None, nwave=None, dtype=np.float32):
+    filename = cache_file(cache_dr, col, kind, dtype)
+    if not os.path.exists(filename):
+        os.makedirs(cache_dr,exist_ok=True)
+        shape = (len(col),nwave,nang) if kind == 'tensor' else col.shape
+        #written under a temporary name, an interrupted run never leaves a partial entry
+        tmp = filename[:-4]+'_%d.tmp'%os.getpid()
+        out = np.lib.format.open_memmap(tmp,mode='w+',dtype=dtype,shape=shape)
+        if kind == 'tensor':
+            rdr.spectra_tensor(col, nang, nwave, out=out, chunk_rows=chunk_rows)
+        else:
+            for a in range(0,len(col),chunk_rows):
+                out[a:a+chunk_rows] = col[a:a+chunk_rows]
+        out.flush()
+        del out
+        os.replace(tmp,filename)
+    return np.load(filename,mmap_mode='r')
+
+
+#spectra of a view as a cached (n,nwave,nang) tensor
+def cached_tensor(col, nang, nwave, cache_dr, dtype=np.float32):
+    return cached(col, cache_dr, 'tensor', nang, nwave, dtype)
+
+
+#rows of a view (thicknesses, one-hot materials, flat spectra), cached
+def cached_rows(col, cache_dr, dtype=np.float32):
+    return cached(col, cache_dr, 'rows', dtype=dtype)
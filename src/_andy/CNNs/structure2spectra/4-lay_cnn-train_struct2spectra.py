@@ -0,0 +1,229 @@
+#structure --> reflect/trans and ellipsometric
+#4 layer structures
+#forward surrogate of the TMM, used to screen the genetic algorithm populations (comparison_methods/genetic/ga_surrogate.py)
+
+
+import warnings
+warnings.filterwarnings('ignore')
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+from numpy import round
+import tensorflow as tf
+from keras import callbacks
+from keras.callbacks import LearningRateScheduler as LRS
+from keras.models import Model
+from keras.layers import *
+from keras import optimizers as opt
+import keras.backend as K
+import matplotlib.pyplot as plt
+import datetime
+global date
+date = datetime.datetime.now()
+import h5py
+import data_reader as rdr
+import data_pipeline as dp
+import scipy.io as sio
+from contextlib import redirect_stdout
+import csv
+
+#make sure you can see the GPU or Keras will attempt to run on CPU
+from tensorflow.python.client import device_lib
+print(device_lib.list_local_devices())
+
+#data rescaling functions
+#puts the data in roughly (0-1) range
+#the genetic algorithm rescales its thicknesses and undoes the psi and delta rescaling the same way (ga_surrogate.py)
+def resc_mat(in_mat):
+    resc = in_mat / 4
+    return resc
+def resc_th(in_th):
+    resc = in_th* 1E7
+    return resc
+def resc_ang(in_theta):
+    resc = in_theta / 45
+    return resc
+def resc_psi(in_psi):
+    resc = in_psi/90
+    return resc
+def resc_delt(in_delt):
+    resc = in_delt/90
+    return resc
+
+#load in the data from the generator file
+#this follows the generator format :
+#[angle,materials,thickness,rp,rs,tp,ts,psi,delta]
+def readin_data(filename,nmat,nang,nlay,nwave):
+    #lazy views of the dataset: rows are read from the file only when they are indexed (see data_reader.py)
+    #read as float32, the precision Keras trains in, to halve the memory of the splits
+    data = rdr.DataSet(filename,nmat,nang,nlay,nwave,dtype=np.float32)
+    theta = data.column('ang')
+    ml1 = data.mats(0)
+    ml2 = data.mats(1)
+    ml3 = data.mats(2)
+    ml4 = data.mats(3)
+    rp = data.column('rp')
+    rs = data.column('rs')
+    tp = data.column('tp')
+    ts = data.column('ts')
+
+    #rescale the data
+    #usually just rescaling angles, thicknesses, psi and delta is OK
+    psi = data.column('psi',resc_psi)
+    delta = data.column('delta',resc_delt)
+    th = data.column('l',resc_th)
+    return (ml1,ml2,ml3,ml4,th,theta,rp,rs,tp,ts,psi,delta)
+
+#read in data from file with the readin_data fcn
+#you need to update the num_mat, ect.. variables with your choices from the generator program
+num_mat = 5
+num_ang = 3
+num_lay = 4
+num_wave = 200
+(ml1,ml2,ml3,ml4,th,ang,rp,rs,tp,ts,psi,delta) = readin_data('/home/arl92/Documents/newdata/data_rte_gen4lay5mat_0ge_240000n_v-tma_20201112.h5',num_mat,num_ang,num_lay,num_wave)
+
+
+#directort to save data
+dr = '/home/arl92/Documents/newdata/s2rt/'
+#cache of the preprocessed sets (see tensor_cache.py), shared by all scripts reading the same dataset
+cache_dr = '/home/arl92/Documents/newdata/cache/'
+
+#ranges for the independent datasets, recommended most data in the training set
+tr = 200000   #training
+va = tr+10000 #validation
+te = va+10000 #test
+
+#the sets are streamed from the file in batches instead of being loaded, see data_pipeline.py
+#the structure is the input here, thicknesses and one-hot materials are fed as rows and the spectra are the outputs
+tr_seq = dp.BatchSequence([th,ml1,ml2,ml3,ml4],[rp,rs,tp,ts,psi,delta],num_ang,num_wave,0,tr,batch_size=128,shuffle=True,cache_dr=cache_dr,tensor_inputs=False)
+va_seq = dp.BatchSequence([th,ml1,ml2,ml3,ml4],[rp,rs,tp,ts,psi,delta],num_ang,num_wave,tr,va,batch_size=128,shuffle=False,cache_dr=cache_dr,tensor_inputs=False)
+te_seq = dp.BatchSequence([th,ml1,ml2,ml3,ml4],[rp,rs,tp,ts,psi,delta],num_ang,num_wave,va,te,batch_size=128,shuffle=False,cache_dr=cache_dr,tensor_inputs=False)
+
+
+#fuction to build the forward model
+#dense network, the structure has no spatial dimension to convolve over
+#takes several hyperparameters as input:
+# nla    = number of dense layers
+# np     = number of dense nodes #1
+# np1    = number of dense nodes #2
+# np2    = number of dense nodes #3
+# drop   = dropout rate
+# a      = learning rate scaling factor
+def define_model(x):
+    global st
+    global modname
+    global model
+    global a
+    st += 1
+    
+    nla = int(x[0])
+    np =  int(x[1])
+    np1 = int(x[2])
+    np2 = int(x[3])
+    drop = x[4]
+    a = x[5]
+    
+    def decay(ep):
+        global a
+        lr = a/((ep)+1)#simple 1 param 1/(t) decay
+        return lr
+    lr = LRS(decay)
+    
+    #input layers, in the order of the genetic algorithm inputs (ga_surrogate.structure_inputs)
+    thin = Input((num_lay,))
+    matin = [Input((num_mat,)) for i in range(num_lay)]
+    
+    #the thicknesses and materials of all layers together
+    s = Concatenate()([thin]+matin)
+    s = Dense(np,activation='relu')(s)
+    s = Dropout(drop)(s)
+    for i in range(nla):
+        s = Dense(np1,activation='relu')(s)
+        s = Dropout(drop)(s)
+    
+    #indepent layers for individual spectra
+    #output nodes are the flattened spectra [spec(ang1),spec(ang2),...] of each quantity
+    out = []
+    for i in range(6):
+        o = Dense(np2,activation='relu')(s)
+        o = Dense(num_ang*num_wave,activation=None)(o)
+        out.append(o)
+
+
+    #define the model
+    #outputs in the order rp, rs, tp, ts, psi, delta (ga_surrogate.quantities)
+    model = Model([thin]+matin,out)
+    # compile the model using the adam optimizer and appropriate loss functions
+    #the loss weights can be used to tune the relative importance of output data . 
+    model.compile(optimizer='adam',loss=['mse']*6,metrics = ['mse'],loss_weights=[1]*6)
+    model.summary()
+
+    #model name can be anything you want
+    modname = dr+'general_4lay5matforward_model_v-tma_dense_s2rtpd_'+str(st)+'step_'+date.strftime("%Y")+date.strftime("%m")+date.strftime("%d")
+    #print the model summary to file for records, the modelname in log also helps with identificaiton of the log files
+    print('-'*57)
+    print(modname)
+    print('-'*57)
+    with open(modname+'_summary.txt', 'w') as f:
+        with redirect_stdout(f):
+            model.summary()
+        
+#function called to fit the model and test the result
+#need to input the hyperparameters into this function
+# x[0] = number of dense layers
+# x[1] = number of dense nodes #1
+# x[2] = number of dense nodes #2
+# x[3] = number of dense nodes #3
+# x[4] = dropout rate
+# x[5] = learning rate scaling factor
+def fit_fcn(x):
+    global modname
+    global st
+    global model
+    
+    #build the model
+    #model is saved as a global variable 
+    define_model(x)
+    
+    #number of epochs to fit
+    leng = 300
+    #fit the model and return the loss and metric history 
+    #fitting based on independent training and validation sets
+    #the lr callback is necessary to decay the learning rate as a function of epoch
+    #batch size can be tuned as necessary
+    #the sequences shuffle the rows themselves, block by block, so the batch order must not be shuffled by keras
+    #batches are prefetched in a background thread (max_queue_size), overlapping the file reads with the training
+    history = model.fit(tr_seq,epochs=leng,verbose=2,validation_data = va_seq,callbacks=[lr],shuffle=False,max_queue_size=10)
+
+    #save model for later uses
+    #this file is the surrogate parameter of the genetic algorithm scripts
+    model.save(modname)
+
+    #evaluate and print stats on the model fit to the log file
+    (te_loss) = model.evaluate(te_seq)
+    print(te_loss)
+
+    #save the model statistics from the fitting and test evaluation
+    try:
+        np.savetxt(modname+'_saveresults.txt',te_loss)
+        #saves the model training progress history
+        sio.savemat(modname+'_history.mat',history.history)
+    except:
+        print('Model epoch training data not saved.\n')
+  
+
+#globals available for the fitting function
+global modname
+global st
+global model
+
+#use as a unique identifier for the output file (or step if training multiple instances)
+st=0
+
+#hyperparameters for building the model
+#starting values, not tuned like the inverse models
+hparams = np.array([3,512,1024,1024,0.0,0.001])
+
+#fit the function using the described hyperparameters
+fit_fcn(hparams)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#Streaming input pipeline for the CNN training scripts
+#batches are read from the HDF5 file while the network trains instead of being loaded before the fit, so the
+#training set is not bounded by memory. Rows are read one block (block_rows rows) at a time, which keeps the
+#file reads contiguous, and the batches of a block are served from memory until the next block is needed.
+#shuffling is done at two levels every epoch: the order of the blocks and the order of the rows in a block.
+#the rescaling of the readin_data views (resc_th, resc_psi, ...) is applied as each block is read, and the
+#input spectra are reshaped into (n,nwave,nang) tensors with data_reader.spectra_tensor
+#
+#   tr_seq = BatchSequence([rp,rs,tp,ts],[th,ml1,ml2],num_ang,num_wave,0,tr)
+#   model.fit(tr_seq,epochs=leng,validation_data=va_seq,shuffle=False)
+#
+#with tensor_inputs=False the inputs are fed as rows too, for the networks taking a structure as input, e.g.
+#   BatchSequence([th,ml1,ml2],[rp,rs,tp,ts,psi,delta],num_ang,num_wave,0,tr,tensor_inputs=False)
+#
+#keras fetches the next batches in a background thread (max_queue_size in fit), so the reads overlap with the
+#training. Pass shuffle=False to fit, the sequence shuffles itself and a random batch order would read a
+#different block for every batch
+#
+#with cache_dr the set is preprocessed once into the tensor cache (see tensor_cache.py) and the blocks are taken
+#from its memory mapped files, so later trainings and evaluations of the same set skip the reading and reshaping
+
+import threading
+import numpy as np
+from keras.utils import Sequence
+import data_reader as rdr
+import tensor_cache as tc
+
+
+class BatchSequence(Sequence):
+    #inputs: views of spectra (data_reader.Column), fed to the network as (n,nwave,nang) tensors
+    #   or as rows like the outputs with tensor_inputs=False
+    #outputs: views fed as rows, e.g. thicknesses (n,nlay), materials (n,nmat) or flat spectra (n,nang*nwave)
+    #rows [start,stop) of the views make up the set, e.g. 0,tr for the training set
+    def __init__(self, inputs, outputs, nang, nwave, start, stop, batch_size=128, shuffle=True,
+                 block_rows=8192, seed=None, cache_dr=None, tensor_inputs=True):
+        self.inputs = [col.rows(start,stop) for col in inputs]
+        self.outputs = [col.rows(start,stop) for col in outputs]
+        self.cached = cache_dr is not None
+        self.tensor_inputs = tensor_inputs
+        if self.cached:
+            if tensor_inputs:
+                self.inputs = [tc.cached_tensor(col,nang,nwave,cache_dr) for col in self.inputs]
+            else:
+                self.inputs = [tc.cached_rows(col,cache_dr) for col in self.inputs]
+            self.outputs = [tc.cached_rows(col,cache_dr) for col in self.outputs]
+        (self.nang,self.nwave) = (nang,nwave)
+        self.numrows = stop-start
+        self.batch_size = batch_size
+        #whole batches in a block, so no batch needs two blocks
+        self.block_rows = max(batch_size,block_rows//batch_size*batch_size)
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(self.numrows/self.batch_size))
+
+    #new block order and row order in each block, the epoch is the list of (block, first row in the block) batches
+    def on_epoch_end(self):
+        numblocks = int(np.ceil(self.numrows/self.block_rows))
+        blocks = self.rng.permutation(numblocks) if self.shuffle else np.arange(numblocks)
+        self.batches = [(b,j) for b in blocks for j in range(0,min(self.block_rows,self.numrows-b*self.block_rows),self.batch_size)]
+        with self.lock:
+            self.cache = {}
+
+    #(inputs,outputs) of block b, with the rows in the order of the epoch
+    def block(self, b):
+        with self.lock:
+            if b not in self.cache:
+                a = b*self.block_rows
+                z = min(a+self.block_rows,self.numrows)
+                if self.cached:
+                    ins = [np.array(x[a:z]) for x in self.inputs]
+                    outs = [np.array(y[a:z]) for y in self.outputs]
+                else:
+                    if self.tensor_inputs:
+                        ins = [rdr.spectra_tensor(col[a:z],self.nang,self.nwave) for col in self.inputs]
+                    else:
+                        ins = [col[a:z] for col in self.inputs]
+                    outs = [col[a:z] for col in self.outputs]
+                if self.shuffle:
+                    order = self.rng.permutation(z-a)
+                    ins = [x[order] for x in ins]
+                    outs = [y[order] for y in outs]
+                #the batches are requested in order, only the last two blocks are kept
+                if len(self.cache) >= 2:
+                    del self.cache[next(iter(self.cache))]
+                self.cache[b] = (ins,outs)
+            return self.cache[b]
+
+    def __getitem__(self, i):
+        (b,j) = self.batches[i]
+        (ins,outs) = self.block(b)
+        return ([x[j:j+self.batch_size] for x in ins],[y[j:j+self.batch_size] for y in outs])
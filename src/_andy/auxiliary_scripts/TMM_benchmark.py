@@ -0,0 +1,202 @@
+#micro-benchmark of the TMM kernels in TMM_numba.py
+#compares the closed-form scalar recurrence for the 2x2 layer product against the previous
+#implementation, which allocated a new layer matrix and called np.dot for every layer
+#reports the cost per (angle, wavelength) point for 1-5 layer stacks and the largest deviation
+#run in this folder: $ python TMM_benchmark.py
+
+from numba import jit
+import numpy as np
+import time
+import TMM_numba as tmm
+
+
+#reference implementation of reflect_amp with a np.dot product of freshly allocated layer matrices
+@jit(nopython=True)
+def reflect_amp_dot(rho, ang_of_inc, wavelength, n, l, n_cover, n_subst):
+    #calculate parameters from the user input
+    #wavenumber
+    k = 2*np.pi/wavelength;
+    #impedance of FS, ohms
+    z0 = 376.730313667
+    #direction cosines
+    beta = np.multiply(n_cover,np.sin(ang_of_inc*np.pi/180))
+    ang = np.arcsin(np.divide(beta,n))
+    alpha = np.multiply(n,np.cos(ang))
+    ang_s = np.arcsin(beta/n_subst)
+    #phase thickness
+    phi = k*np.multiply(alpha,l)
+    #gamma parameter different for TE and TM
+    if rho == 0:
+        gamma = alpha/z0
+        #gamma in cover(above) and substrate(below)
+        gammac = n_cover*np.cos(ang_of_inc*np.pi/180)/z0
+        gammas = n_subst*np.cos(ang_s)/z0
+    elif rho == 1:
+        gamma = z0*np.divide(np.cos(ang),n)
+        gammac = z0*np.cos(ang_of_inc*np.pi/180)/n_cover
+        gammas = z0*np.cos(ang_s)/n_subst
+    else:
+        #exception handling
+        print("Exception in Pol State. Ending...")
+        return
+        
+    #calculate transfer matrix for entire stack as product
+    m = np.eye(2,dtype=np.complex128)
+    for i in np.arange(n.size):
+        m = np.dot(m,np.array([[np.cos(phi[i]),-1j*np.divide(np.sin(phi[i]),gamma[i])],[-1j*np.multiply(np.sin(phi[i]),gamma[i]),np.cos(phi[i])]]))
+    
+    #calculate R & T
+    #reflection coefficient
+    r = (gammac*m[0,0]+gammac*gammas*m[0,1]-m[1,0]-gammas*m[1,1])/(gammac*m[0,0]+gammac*gammas*m[0,1]+m[1,0]+gammas*m[1,1])
+    r_amp = np.square(np.abs(r))
+    return r_amp
+
+
+#reference implementation of trans_amp
+@jit(nopython=True)
+def trans_amp_dot(rho, ang_of_inc, wavelength, n, l, n_cover, n_subst):
+    #calculate parameters from the user input
+    #wavenumber
+    k = 2*np.pi/wavelength;
+    #impedance of FS, ohms
+    z0 = 376.730313667
+    #direction cosines
+    beta = np.multiply(n_cover,np.sin(ang_of_inc*np.pi/180))
+    ang = np.arcsin(np.divide(beta,n))
+    alpha = np.multiply(n,np.cos(ang))
+    ang_s = np.arcsin(beta/n_subst)
+    #phase thickness
+    phi = k*np.multiply(alpha,l)
+    #gamma parameter different for TE and TM
+    if rho == 0:
+        gamma = alpha/z0
+        #gamma in cover(above) and substrate(below)
+        gammac = n_cover*np.cos(ang_of_inc*np.pi/180)/z0
+        gammas = n_subst*np.cos(ang_s)/z0
+    elif rho == 1:
+        gamma = z0*np.divide(np.cos(ang),n)
+        gammac = z0*np.cos(ang_of_inc*np.pi/180)/n_cover
+        gammas = z0*np.cos(ang_s)/n_subst
+    else:
+        #exception handling
+        print("Exception in Pol State. Ending...")
+        return
+        
+    #calculate transfer matrix for entire stack as product
+    m = np.eye(2,dtype=np.complex128)
+    for i in np.arange(n.size):
+        m = np.dot(m,np.array([[np.cos(phi[i]),-1j*np.divide(np.sin(phi[i]),gamma[i])],[-1j*np.multiply(np.sin(phi[i]),gamma[i]),np.cos(phi[i])]]))
+    
+    #calculate R & T
+    #transmission coefficient
+    t = (2*gammac)/(gammac*m[0,0]+gammac*gammas*m[0,1]+m[1,0]+gammas*m[1,1])
+    t_amp = (np.real(gammas)/np.real(gammac))*np.square(np.abs(t))
+    return t_amp
+
+
+#reference implementation of ellips
+@jit(nopython=True)
+def ellips_dot(ang_of_inc, wavelength, n, l, n_cover, n_subst):
+#     if np.any(l <= 1E-12):
+#         print('OOB thickness!')
+#         return(90.,90.)
+    #calculate parameters from the user input
+    #wavenumber
+    k = 2*np.pi/wavelength;
+    #impedance of FS, ohms
+    z0 = 376.730313667
+     #direction cosines
+    beta = np.multiply(n_cover,np.sin(ang_of_inc*np.pi/180))
+    ang = np.arcsin(np.divide(beta,n))
+    alpha = np.multiply(n,np.cos(ang))
+    ang_s = np.arcsin(beta/n_subst)
+    #phase thickness
+    phi = k*np.multiply(alpha,l)
+    #gamma parameter different for TE and TM
+    gamma0 = alpha/z0
+    gamma1 = z0*np.divide(np.cos(ang),n)
+    #gamma in cover(above) and substrate(below)
+    gammac0 = n_cover*np.cos(ang_of_inc*np.pi/180)/z0
+    gammas0 = n_subst*np.cos(ang_s)/z0   
+    gammac1 = z0*np.cos(ang_of_inc*np.pi/180)/n_cover
+    gammas1 = z0*np.cos(ang_s)/n_subst
+
+    #calculate transfer matrix for TE polarization (rho = 0)
+    m0 = np.eye(2,dtype=np.complex128)
+    for i in np.arange(n.size):
+        m0 = np.dot(m0,np.array([[np.cos(phi[i]),-1j*np.divide(np.sin(phi[i]),gamma0[i])],[-1j*np.multiply(np.sin(phi[i]),gamma0[i]),np.cos(phi[i])]]))
+    #reflection coefficient
+    r0 = (gammac0*m0[0,0]+gammac0*gammas0*m0[0,1]-m0[1,0]-gammas0*m0[1,1])/(gammac0*m0[0,0]+gammac0*gammas0*m0[0,1]+m0[1,0]+gammas0*m0[1,1])
+
+    #calculate transfer matrix for TM polarization (rho = 1)
+    m1 = np.eye(2,dtype=np.complex128)
+    for i in np.arange(n.size):
+        m1 = np.dot(m1,np.array([[np.cos(phi[i]),-1j*np.divide(np.sin(phi[i]),gamma1[i])],[-1j*np.multiply(np.sin(phi[i]),gamma1[i]),np.cos(phi[i])]]))
+    #reflection coefficient
+    r1 = (gammac1*m1[0,0]+gammac1*gammas1*m1[0,1]-m1[1,0]-gammas1*m1[1,1])/(gammac1*m1[0,0]+gammac1*gammas1*m1[0,1]+m1[1,0]+gammas1*m1[1,1])
+ 
+    #calculate Psi and Delta
+    psi = np.arctan(np.abs(r1/r0))*(180/np.pi)
+    delta = (2*np.pi-np.imag(np.log(r0/r1))-(np.imag(r1/r0)))  #From Giuseppe TMM code
+    return (psi,delta)
+
+
+#evaluate every point of the (ang, wave) grid with the reference kernels
+@jit(nopython=True)
+def sweep_dot(ang, wave, n, l, n_cover, n_subst, out):
+    for j in range(ang.size):
+        for i in range(wave.size):
+            out[0,j,i] = reflect_amp_dot(1, ang[j], wave[i], n[:,i], l, n_cover, n_subst[i])
+            out[1,j,i] = reflect_amp_dot(0, ang[j], wave[i], n[:,i], l, n_cover, n_subst[i])
+            out[2,j,i] = trans_amp_dot(1, ang[j], wave[i], n[:,i], l, n_cover, n_subst[i])
+            out[3,j,i] = trans_amp_dot(0, ang[j], wave[i], n[:,i], l, n_cover, n_subst[i])
+            (out[4,j,i],out[5,j,i]) = ellips_dot(ang[j], wave[i], n[:,i], l, n_cover, n_subst[i])
+    return out
+
+
+#evaluate every point of the (ang, wave) grid with the current kernels
+@jit(nopython=True)
+def sweep(ang, wave, n, l, n_cover, n_subst, out):
+    for j in range(ang.size):
+        for i in range(wave.size):
+            out[0,j,i] = tmm.reflect_amp(1, ang[j], wave[i], n[:,i], l, n_cover, n_subst[i])
+            out[1,j,i] = tmm.reflect_amp(0, ang[j], wave[i], n[:,i], l, n_cover, n_subst[i])
+            out[2,j,i] = tmm.trans_amp(1, ang[j], wave[i], n[:,i], l, n_cover, n_subst[i])
+            out[3,j,i] = tmm.trans_amp(0, ang[j], wave[i], n[:,i], l, n_cover, n_subst[i])
+            (out[4,j,i],out[5,j,i]) = tmm.ellips(ang[j], wave[i], n[:,i], l, n_cover, n_subst[i])
+    return out
+
+
+#best of several repeats, in seconds
+def timeit(fcn, args, repeats):
+    fcn(*args)
+    best = 1E10
+    for r in range(repeats):
+        start = time.perf_counter()
+        fcn(*args)
+        best = min(best, time.perf_counter()-start)
+    return best
+
+
+#same wavelengths and angles as the data generation script
+#representative non-dispersive indices for Ag, Al2O3, ITO, Ni, TiO2 and a glass substrate
+#keeps the benchmark independent of the material modules, the cost does not depend on dispersion
+wave = np.linspace(450,950,200)*1E-9
+ang = np.array([25.,45.,65.])
+nk = np.array([0.05+3.4j,1.77+0j,1.85+0.01j,1.9+3.6j,2.45+0j])
+materials = np.repeat(nk[:,np.newaxis],wave.size,axis=1)
+n_subst = np.full(wave.size,1.52+0j)
+repeats = 20
+
+np.random.seed(35447)
+print('layers  reference [us/pt]  recurrence [us/pt]  speedup  max deviation')
+for num_lay in range(1,6):
+    n = np.ascontiguousarray(materials[np.arange(num_lay)%materials.shape[0]])
+    l = np.random.uniform(1E-9,60E-9,size=num_lay)
+    out0 = np.zeros((6,ang.size,wave.size))
+    out1 = np.zeros((6,ang.size,wave.size))
+    t0 = timeit(sweep_dot,(ang,wave,n,l,1.,n_subst,out0),repeats)
+    t1 = timeit(sweep,(ang,wave,n,l,1.,n_subst,out1),repeats)
+    #each point evaluates Rp, Rs, Tp, Ts, Psi and Delta
+    npts = ang.size*wave.size
+    print('%6d  %17.3f  %18.3f  %7.1fx  %13.2e'%(num_lay,t0/npts*1E6,t1/npts*1E6,t0/t1,np.max(np.abs(out0-out1))))
@@ -2,7 +2,7 @@
 #Implementation of Chillwell(1984) thin film TMM
 #arl92@case.edu   09/08/2019
 
-from numba import jit
+from numba import jit, prange, set_num_threads
 import numpy as np
 
 #Sample parameters list
@@ -24,134 +24,555 @@ import numpy as np
 #calculate and return the reflection amplitude for system in given POL state
 @jit(nopython=True)
 def reflect_amp(rho, ang_of_inc, wavelength, n, l, n_cover, n_subst):
-    #calculate parameters from the user input
-    #wavenumber
-    k = 2*np.pi/wavelength;
-    #impedance of FS, ohms
-    z0 = 376.730313667
-    #direction cosines
-    beta = np.multiply(n_cover,np.sin(ang_of_inc*np.pi/180))
-    ang = np.arcsin(np.divide(beta,n))
-    alpha = np.multiply(n,np.cos(ang))
-    ang_s = np.arcsin(beta/n_subst)
-    #phase thickness
-    phi = k*np.multiply(alpha,l)
-    #gamma parameter different for TE and TM
-    if rho == 0:
-        gamma = alpha/z0
-        #gamma in cover(above) and substrate(below)
-        gammac = n_cover*np.cos(ang_of_inc*np.pi/180)/z0
-        gammas = n_subst*np.cos(ang_s)/z0
-    elif rho == 1:
-        gamma = z0*np.divide(np.cos(ang),n)
-        gammac = z0*np.cos(ang_of_inc*np.pi/180)/n_cover
-        gammas = z0*np.cos(ang_s)/n_subst
-    else:
+    if rho != 0 and rho != 1:
         #exception handling
         print("Exception in Pol State. Ending...")
         return
-        
-    #calculate transfer matrix for entire stack as product
-    m = np.eye(2,dtype=np.complex128)
-    for i in np.arange(n.size):
-        m = np.dot(m,np.array([[np.cos(phi[i]),-1j*np.divide(np.sin(phi[i]),gamma[i])],[-1j*np.multiply(np.sin(phi[i]),gamma[i]),np.cos(phi[i])]]))
-    
-    #calculate R & T
-    #reflection coefficient
-    r = (gammac*m[0,0]+gammac*gammas*m[0,1]-m[1,0]-gammas*m[1,1])/(gammac*m[0,0]+gammac*gammas*m[0,1]+m[1,0]+gammas*m[1,1])
-    r_amp = np.square(np.abs(r))
+    #transfer matrix for the entire stack is built in stack_amp without temporary arrays
+    (r,t,tfac) = stack_amp(rho, ang_of_inc, wavelength, n, l, n_cover, n_subst)
+    r_amp = np.real(r)**2+np.imag(r)**2
     return r_amp
 
 
 #calculate and return the transmission amplitude for the system in given POL state
 @jit(nopython=True)
 def trans_amp(rho, ang_of_inc, wavelength, n, l, n_cover, n_subst):
-    #calculate parameters from the user input
-    #wavenumber
-    k = 2*np.pi/wavelength;
-    #impedance of FS, ohms
-    z0 = 376.730313667
-    #direction cosines
-    beta = np.multiply(n_cover,np.sin(ang_of_inc*np.pi/180))
-    ang = np.arcsin(np.divide(beta,n))
-    alpha = np.multiply(n,np.cos(ang))
-    ang_s = np.arcsin(beta/n_subst)
-    #phase thickness
-    phi = k*np.multiply(alpha,l)
-    #gamma parameter different for TE and TM
-    if rho == 0:
-        gamma = alpha/z0
-        #gamma in cover(above) and substrate(below)
-        gammac = n_cover*np.cos(ang_of_inc*np.pi/180)/z0
-        gammas = n_subst*np.cos(ang_s)/z0
-    elif rho == 1:
-        gamma = z0*np.divide(np.cos(ang),n)
-        gammac = z0*np.cos(ang_of_inc*np.pi/180)/n_cover
-        gammas = z0*np.cos(ang_s)/n_subst
-    else:
+    if rho != 0 and rho != 1:
         #exception handling
         print("Exception in Pol State. Ending...")
         return
-        
-    #calculate transfer matrix for entire stack as product
-    m = np.eye(2,dtype=np.complex128)
-    for i in np.arange(n.size):
-        m = np.dot(m,np.array([[np.cos(phi[i]),-1j*np.divide(np.sin(phi[i]),gamma[i])],[-1j*np.multiply(np.sin(phi[i]),gamma[i]),np.cos(phi[i])]]))
-    
-    #calculate R & T
-    #transmission coefficient
-    t = (2*gammac)/(gammac*m[0,0]+gammac*gammas*m[0,1]+m[1,0]+gammas*m[1,1])
-    t_amp = (np.real(gammas)/np.real(gammac))*np.square(np.abs(t))
+    (r,t,tfac) = stack_amp(rho, ang_of_inc, wavelength, n, l, n_cover, n_subst)
+    t_amp = tfac*(np.real(t)**2+np.imag(t)**2)
     return t_amp
 
 
 #calculate and return ellipsometric parameters for the system
 @jit(nopython=True)
 def ellips(ang_of_inc, wavelength, n, l, n_cover, n_subst):
-#     if np.any(l <= 1E-12):
-#         print('OOB thickness!')
-#         return(90.,90.)
-    #calculate parameters from the user input
-    #wavenumber
-    k = 2*np.pi/wavelength;
-    #impedance of FS, ohms
-    z0 = 376.730313667
-     #direction cosines
-    beta = np.multiply(n_cover,np.sin(ang_of_inc*np.pi/180))
-    ang = np.arcsin(np.divide(beta,n))
-    alpha = np.multiply(n,np.cos(ang))
-    ang_s = np.arcsin(beta/n_subst)
-    #phase thickness
-    phi = k*np.multiply(alpha,l)
-    #gamma parameter different for TE and TM
-    gamma0 = alpha/z0
-    gamma1 = z0*np.divide(np.cos(ang),n)
-    #gamma in cover(above) and substrate(below)
-    gammac0 = n_cover*np.cos(ang_of_inc*np.pi/180)/z0
-    gammas0 = n_subst*np.cos(ang_s)/z0   
-    gammac1 = z0*np.cos(ang_of_inc*np.pi/180)/n_cover
-    gammas1 = z0*np.cos(ang_s)/n_subst
-
-    #calculate transfer matrix for TE polarization (rho = 0)
-    m0 = np.eye(2,dtype=np.complex128)
-    for i in np.arange(n.size):
-        m0 = np.dot(m0,np.array([[np.cos(phi[i]),-1j*np.divide(np.sin(phi[i]),gamma0[i])],[-1j*np.multiply(np.sin(phi[i]),gamma0[i]),np.cos(phi[i])]]))
-    #reflection coefficient
-    r0 = (gammac0*m0[0,0]+gammac0*gammas0*m0[0,1]-m0[1,0]-gammas0*m0[1,1])/(gammac0*m0[0,0]+gammac0*gammas0*m0[0,1]+m0[1,0]+gammas0*m0[1,1])
-
-    #calculate transfer matrix for TM polarization (rho = 1)
-    m1 = np.eye(2,dtype=np.complex128)
-    for i in np.arange(n.size):
-        m1 = np.dot(m1,np.array([[np.cos(phi[i]),-1j*np.divide(np.sin(phi[i]),gamma1[i])],[-1j*np.multiply(np.sin(phi[i]),gamma1[i]),np.cos(phi[i])]]))
-    #reflection coefficient
-    r1 = (gammac1*m1[0,0]+gammac1*gammas1*m1[0,1]-m1[1,0]-gammas1*m1[1,1])/(gammac1*m1[0,0]+gammac1*gammas1*m1[0,1]+m1[1,0]+gammas1*m1[1,1])
- 
+    #TE (r0) and TM (r1) reflection coefficients from a single pass over the layers
+    (r0,r1,t0,t1,tfac0,tfac1) = amplitudes(ang_of_inc, wavelength, n, l, n_cover, n_subst)
     #calculate Psi and Delta
     psi = np.arctan(np.abs(r1/r0))*(180/np.pi)
     delta = (2*np.pi-np.imag(np.log(r0/r1))-(np.imag(r1/r0)))  #From Giuseppe TMM code
     return (psi,delta)
+
+
+#calculate the characteristic matrix of the stack for one polarization at a single wavelength
+#the 2x2 product is carried in four complex scalars so no arrays are allocated inside the layer loop
+#beta is the (conserved) tangential index n_cover*sin(ang_of_inc), k is the wavenumber
+#returns the matrix elements (m00, m01, m10, m11)
+@jit(nopython=True)
+def stack_matrix(rho, beta, k, n, l):
+    #impedance of FS, ohms
+    z0 = 376.730313667
+    m00 = 1.+0j
+    m01 = 0j
+    m10 = 0j
+    m11 = 1.+0j
+    for i in range(n.size):
+        #cos(arcsin(beta/n)) without evaluating the arcsin
+        cosang = np.sqrt(1-(beta/n[i])**2+0j)
+        alpha = n[i]*cosang
+        #phase thickness
+        phi = k*alpha*l[i]
+        #gamma parameter different for TE and TM
+        if rho == 0:
+            gamma = alpha/z0
+        else:
+            gamma = z0*cosang/n[i]
+        c = np.cos(phi)
+        s = np.sin(phi)
+        a01 = -1j*s/gamma
+        a10 = -1j*s*gamma
+        #right multiply the running product by the layer matrix [[c,a01],[a10,c]]
+        t00 = m00*c+m01*a10
+        t10 = m10*c+m11*a10
+        m01 = m00*a01+m01*c
+        m11 = m10*a01+m11*c
+        m00 = t00
+        m10 = t10
+    return (m00,m01,m10,m11)
+
+
+#calculate the complex reflection and transmission coefficients for the system in given POL state
+#returns (r, t, tfac) where tfac*|t|^2 is the transmittance
+@jit(nopython=True)
+def stack_amp(rho, ang_of_inc, wavelength, n, l, n_cover, n_subst):
+    z0 = 376.730313667
+    k = 2*np.pi/wavelength
+    beta = n_cover*np.sin(ang_of_inc*np.pi/180)
+    cosc = np.cos(ang_of_inc*np.pi/180)
+    coss = np.sqrt(1-(beta/n_subst)**2+0j)
+    if rho == 0:
+        gammac = n_cover*cosc/z0
+        gammas = n_subst*coss/z0
+    else:
+        gammac = z0*cosc/n_cover
+        gammas = z0*coss/n_subst
+    (m00,m01,m10,m11) = stack_matrix(rho, beta, k, n, l)
+    den = gammac*m00+gammac*gammas*m01+m10+gammas*m11
+    r = (gammac*m00+gammac*gammas*m01-m10-gammas*m11)/den
+    t = (2*gammac)/den
+    tfac = np.real(gammas)/np.real(gammac)
+    return (r,t,tfac)
+
+
+#calculate the characteristic matrices of the stack for both polarizations at a single wavelength
+#the direction cosines, phase thicknesses and sin/cos of each layer are shared by TE and TM so they are only computed once
+#returns the TE (rho = 0) matrix elements followed by the TM (rho = 1) matrix elements
+@jit(nopython=True)
+def stack_matrices(beta, k, n, l):
+    z0 = 376.730313667
+    a00 = 1.+0j
+    a01 = 0j
+    a10 = 0j
+    a11 = 1.+0j
+    b00 = 1.+0j
+    b01 = 0j
+    b10 = 0j
+    b11 = 1.+0j
+    for i in range(n.size):
+        cosang = np.sqrt(1-(beta/n[i])**2+0j)
+        alpha = n[i]*cosang
+        phi = k*alpha*l[i]
+        gamma0 = alpha/z0
+        gamma1 = z0*cosang/n[i]
+        c = np.cos(phi)
+        s = np.sin(phi)
+        #TE layer product
+        d01 = -1j*s/gamma0
+        d10 = -1j*s*gamma0
+        t00 = a00*c+a01*d10
+        t10 = a10*c+a11*d10
+        a01 = a00*d01+a01*c
+        a11 = a10*d01+a11*c
+        a00 = t00
+        a10 = t10
+        #TM layer product
+        d01 = -1j*s/gamma1
+        d10 = -1j*s*gamma1
+        t00 = b00*c+b01*d10
+        t10 = b10*c+b11*d10
+        b01 = b00*d01+b01*c
+        b11 = b10*d01+b11*c
+        b00 = t00
+        b10 = t10
+    return (a00,a01,a10,a11,b00,b01,b10,b11)
+
+
+#calculate the complex reflection and transmission coefficients for both polarizations in one pass
+#returns (r0, r1, t0, t1, tfac0, tfac1), 0 = TE, 1 = TM, where tfac*|t|^2 is the transmittance
+@jit(nopython=True)
+def amplitudes(ang_of_inc, wavelength, n, l, n_cover, n_subst):
+    z0 = 376.730313667
+    k = 2*np.pi/wavelength
+    beta = n_cover*np.sin(ang_of_inc*np.pi/180)
+    cosc = np.cos(ang_of_inc*np.pi/180)
+    coss = np.sqrt(1-(beta/n_subst)**2+0j)
+    gammac0 = n_cover*cosc/z0
+    gammas0 = n_subst*coss/z0
+    gammac1 = z0*cosc/n_cover
+    gammas1 = z0*coss/n_subst
+    (a00,a01,a10,a11,b00,b01,b10,b11) = stack_matrices(beta, k, n, l)
+    den0 = gammac0*a00+gammac0*gammas0*a01+a10+gammas0*a11
+    r0 = (gammac0*a00+gammac0*gammas0*a01-a10-gammas0*a11)/den0
+    t0 = (2*gammac0)/den0
+    den1 = gammac1*b00+gammac1*gammas1*b01+b10+gammas1*b11
+    r1 = (gammac1*b00+gammac1*gammas1*b01-b10-gammas1*b11)/den1
+    t1 = (2*gammac1)/den1
+    tfac0 = np.real(gammas0)/np.real(gammac0)
+    tfac1 = np.real(gammas1)/np.real(gammac1)
+    return (r0,r1,t0,t1,tfac0,tfac1)
+
+
+#reflection and transmission coefficients of a stack with characteristic matrix m between cover and substrate
+@jit(nopython=True)
+def fresnel(gammac, gammas, m00, m01, m10, m11):
+    den = gammac*m00+gammac*gammas*m01+m10+gammas*m11
+    r = (gammac*m00+gammac*gammas*m01-m10-gammas*m11)/den
+    t = (2*gammac)/den
+    return (r,t)
+
+
+#calculate Rp, Rs, Tp, Ts, Psi and Delta for the system from a single evaluation of both transfer matrices
+#gives the same values as reflect_amp(1,...), reflect_amp(0,...), trans_amp(1,...), trans_amp(0,...) and ellips(...)
+@jit(nopython=True)
+def spectra(ang_of_inc, wavelength, n, l, n_cover, n_subst):
+    (r0,r1,t0,t1,tfac0,tfac1) = amplitudes(ang_of_inc, wavelength, n, l, n_cover, n_subst)
+    return observables(r0,r1,t0,t1,tfac0,tfac1)
+
+
+#batched versions of reflect_amp, trans_amp and ellips
+#evaluate every structure at every angle and wavelength in a single compiled call
+#   ang     : (A,) angles of incidence [deg]
+#   wave    : (W,) wavelengths [m]
+#   n       : (S,L,W) complex index of each layer of each structure
+#   l       : (S,L) layer thicknesses [m]
+#   n_cover : (W,) cover (superstrate) index, use np.ones(wave.size) for void
+#   n_subst : (W,) substrate index
+#outputs are (S,A,W) arrays
+#the (structure, wavelength) pairs are a single prange loop, so the *_par versions below split
+#them over threads whether there are many structures or only one
+@jit(nopython=True)
+def reflect_amp_batch(rho, ang, wave, n, l, n_cover, n_subst):
+    out = np.zeros((n.shape[0],ang.size,wave.size))
+    for q in prange(n.shape[0]*wave.size):
+        s = q//wave.size
+        i = q%wave.size
+        for j in range(ang.size):
+            (r,t,tfac) = stack_amp(rho, ang[j], wave[i], n[s,:,i], l[s], n_cover[i], n_subst[i])
+            out[s,j,i] = np.real(r)**2+np.imag(r)**2
+    return out
+
+
+@jit(nopython=True)
+def trans_amp_batch(rho, ang, wave, n, l, n_cover, n_subst):
+    out = np.zeros((n.shape[0],ang.size,wave.size))
+    for q in prange(n.shape[0]*wave.size):
+        s = q//wave.size
+        i = q%wave.size
+        for j in range(ang.size):
+            (r,t,tfac) = stack_amp(rho, ang[j], wave[i], n[s,:,i], l[s], n_cover[i], n_subst[i])
+            out[s,j,i] = tfac*(np.real(t)**2+np.imag(t)**2)
+    return out
+
+
+@jit(nopython=True)
+def ellips_batch(ang, wave, n, l, n_cover, n_subst):
+    psi = np.zeros((n.shape[0],ang.size,wave.size))
+    delta = np.zeros((n.shape[0],ang.size,wave.size))
+    for q in prange(n.shape[0]*wave.size):
+        s = q//wave.size
+        i = q%wave.size
+        for j in range(ang.size):
+            (r0,r1,t0,t1,tfac0,tfac1) = amplitudes(ang[j], wave[i], n[s,:,i], l[s], n_cover[i], n_subst[i])
+            #same definitions of Psi and Delta as ellips
+            psi[s,j,i] = np.arctan(np.abs(r1/r0))*(180/np.pi)
+            delta[s,j,i] = (2*np.pi-np.imag(np.log(r0/r1))-(np.imag(r1/r0)))
+    return (psi,delta)
+
+
+#batched version of spectra, all six observables from one pass over the (S,A,W) grid
+#returns (rp, rs, tp, ts, psi, delta) as (S,A,W) arrays
+@jit(nopython=True)
+def spectra_batch(ang, wave, n, l, n_cover, n_subst):
+    rp = np.zeros((n.shape[0],ang.size,wave.size))
+    rs = np.zeros((n.shape[0],ang.size,wave.size))
+    tp = np.zeros((n.shape[0],ang.size,wave.size))
+    ts = np.zeros((n.shape[0],ang.size,wave.size))
+    psi = np.zeros((n.shape[0],ang.size,wave.size))
+    delta = np.zeros((n.shape[0],ang.size,wave.size))
+    for q in prange(n.shape[0]*wave.size):
+        s = q//wave.size
+        i = q%wave.size
+        for j in range(ang.size):
+            (rp[s,j,i],rs[s,j,i],tp[s,j,i],ts[s,j,i],psi[s,j,i],delta[s,j,i]) = spectra(ang[j], wave[i], n[s,:,i], l[s], n_cover[i], n_subst[i])
+    return (rp,rs,tp,ts,psi,delta)
+
+
+#batched complex amplitudes, for when the phase of r and t is needed
+#returns (rp, rs, tp, ts) complex (S,A,W) arrays of the reflection and transmission coefficients
+@jit(nopython=True)
+def amplitudes_batch(ang, wave, n, l, n_cover, n_subst):
+    rp = np.zeros((n.shape[0],ang.size,wave.size),dtype=np.complex128)
+    rs = np.zeros((n.shape[0],ang.size,wave.size),dtype=np.complex128)
+    tp = np.zeros((n.shape[0],ang.size,wave.size),dtype=np.complex128)
+    ts = np.zeros((n.shape[0],ang.size,wave.size),dtype=np.complex128)
+    for q in prange(n.shape[0]*wave.size):
+        s = q//wave.size
+        i = q%wave.size
+        for j in range(ang.size):
+            (rs[s,j,i],rp[s,j,i],ts[s,j,i],tp[s,j,i],tfac0,tfac1) = amplitudes(ang[j], wave[i], n[s,:,i], l[s], n_cover[i], n_subst[i])
+    return (rp,rs,tp,ts)
+
+
+#index of refraction (S,L,W) of structures given as material numbers, gathered from a table of materials
+#   materials : (M,W) complex index of each material
+#   mats      : (S,L) material number of each layer (may be stored as floats, e.g. GA genes)
+@jit(nopython=True)
+def gather_index(materials, mats):
+    n = np.empty((mats.shape[0],mats.shape[1],materials.shape[1]),dtype=np.complex128)
+    for s in prange(mats.shape[0]):
+        for j in range(mats.shape[1]):
+            n[s,j,:] = materials[int(mats[s,j])]
+    return n
+
+
+#mean squared error of the spectra of every structure against target spectra, the spectra themselves are not kept
+#   which   : (Q,) quantities compared, numbers into (rp, rs, tp, ts, psi, delta)
+#   targets : (Q,A*W) target spectra of these quantities flattened as [spec(ang1),spec(ang2),...]
+#other arguments as in spectra_batch, returns (S,) mse over all quantities, angles and wavelengths
+@jit(nopython=True)
+def mse_batch(ang, wave, n, l, n_cover, n_subst, which, targets):
+    err = np.zeros((n.shape[0],wave.size))
+    for q in prange(n.shape[0]*wave.size):
+        s = q//wave.size
+        i = q%wave.size
+        acc = 0.
+        for j in range(ang.size):
+            out = spectra(ang[j], wave[i], n[s,:,i], l[s], n_cover[i], n_subst[i])
+            for k in range(which.size):
+                acc += (out[which[k]]-targets[k,i+wave.size*j])**2
+        err[s,i] = acc
+    return np.sum(err,axis=1)/(which.size*ang.size*wave.size)
+
+
+#multi-threaded versions of the batched kernels
+#the same loops compiled with parallel=True, all threads work in one process on shared arrays
+#so nothing is copied to workers. The thread count is set with set_threads
+reflect_amp_batch_par = jit(nopython=True, parallel=True)(reflect_amp_batch.py_func)
+trans_amp_batch_par = jit(nopython=True, parallel=True)(trans_amp_batch.py_func)
+ellips_batch_par = jit(nopython=True, parallel=True)(ellips_batch.py_func)
+spectra_batch_par = jit(nopython=True, parallel=True)(spectra_batch.py_func)
+amplitudes_batch_par = jit(nopython=True, parallel=True)(amplitudes_batch.py_func)
+gather_index_par = jit(nopython=True, parallel=True)(gather_index.py_func)
+mse_batch_par = jit(nopython=True, parallel=True)(mse_batch.py_func)
+
+
+#set the number of threads used by the *_par kernels
+#can be at most the number of cores found when numba started (or NUMBA_NUM_THREADS)
+def set_threads(num_threads):
+    set_num_threads(num_threads)
     
     
+#product of two 2x2 matrices given by their elements
+@jit(nopython=True)
+def mat_mul(a00, a01, a10, a11, b00, b01, b10, b11):
+    return (a00*b00+a01*b10,a00*b01+a01*b11,a10*b00+a11*b10,a10*b01+a11*b11)
+
+
+#calculate Rp, Rs, Tp, Ts, Psi and Delta for a single structure and their exact derivatives with respect to each layer thickness
+#the derivative of the stack matrix for layer q is prefix(q) * dM_q/dl_q * suffix(q+1), with dM_q/dl_q = k*alpha_q*dM_q/dphi_q,
+#so values and derivatives come from the same pass over the layers
+#   ang, wave, n_cover, n_subst as in the batched kernels, n : (L,W) index of each layer, l : (L,) thicknesses [m]
+#returns (spec, jac), spec : (6,A,W) = [rp,rs,tp,ts,psi,delta], jac : (6,A,W,L) derivatives per meter of thickness
+@jit(nopython=True)
+def spectra_jac(ang, wave, n, l, n_cover, n_subst):
+    z0 = 376.730313667
+    num_lay = l.size
+    spec = np.zeros((6,ang.size,wave.size))
+    jac = np.zeros((6,ang.size,wave.size,num_lay))
+    #per layer cos(phi), sin(phi), dphi/dl and gamma for TE and TM
+    c = np.zeros(num_lay,dtype=np.complex128)
+    s = np.zeros(num_lay,dtype=np.complex128)
+    dphi = np.zeros(num_lay,dtype=np.complex128)
+    gam = np.zeros((2,num_lay),dtype=np.complex128)
+    #prefix and suffix partial products, stored as [m00,m01,m10,m11]
+    pre = np.zeros((num_lay+1,4),dtype=np.complex128)
+    suf = np.zeros((num_lay+1,4),dtype=np.complex128)
+    #derivatives of r and t for each polarization and layer
+    dr = np.zeros((2,num_lay),dtype=np.complex128)
+    dt = np.zeros((2,num_lay),dtype=np.complex128)
+    r = np.zeros(2,dtype=np.complex128)
+    t = np.zeros(2,dtype=np.complex128)
+    tfac = np.zeros(2)
+    for j in range(ang.size):
+        for i in range(wave.size):
+            k = 2*np.pi/wave[i]
+            beta = n_cover[i]*np.sin(ang[j]*np.pi/180)
+            cosc = np.cos(ang[j]*np.pi/180)
+            coss = np.sqrt(1-(beta/n_subst[i])**2+0j)
+            for q in range(num_lay):
+                cosang = np.sqrt(1-(beta/n[q,i])**2+0j)
+                alpha = n[q,i]*cosang
+                dphi[q] = k*alpha
+                c[q] = np.cos(dphi[q]*l[q])
+                s[q] = np.sin(dphi[q]*l[q])
+                gam[0,q] = alpha/z0
+                gam[1,q] = z0*cosang/n[q,i]
+            for rho in range(2):
+                if rho == 0:
+                    gammac = n_cover[i]*cosc/z0+0j
+                    gammas = n_subst[i]*coss/z0
+                else:
+                    gammac = z0*cosc/n_cover[i]+0j
+                    gammas = z0*coss/n_subst[i]
+                pre[0,0] = 1.
+                pre[0,1] = 0.
+                pre[0,2] = 0.
+                pre[0,3] = 1.
+                suf[num_lay,0] = 1.
+                suf[num_lay,1] = 0.
+                suf[num_lay,2] = 0.
+                suf[num_lay,3] = 1.
+                for q in range(num_lay):
+                    (pre[q+1,0],pre[q+1,1],pre[q+1,2],pre[q+1,3]) = mat_mul(pre[q,0],pre[q,1],pre[q,2],pre[q,3],
+                        c[q],-1j*s[q]/gam[rho,q],-1j*s[q]*gam[rho,q],c[q])
+                    p = num_lay-1-q
+                    (suf[p,0],suf[p,1],suf[p,2],suf[p,3]) = mat_mul(c[p],-1j*s[p]/gam[rho,p],-1j*s[p]*gam[rho,p],c[p],
+                        suf[p+1,0],suf[p+1,1],suf[p+1,2],suf[p+1,3])
+                den = gammac*pre[num_lay,0]+gammac*gammas*pre[num_lay,1]+pre[num_lay,2]+gammas*pre[num_lay,3]
+                num = gammac*pre[num_lay,0]+gammac*gammas*pre[num_lay,1]-pre[num_lay,2]-gammas*pre[num_lay,3]
+                r[rho] = num/den
+                t[rho] = (2*gammac)/den
+                tfac[rho] = np.real(gammas)/np.real(gammac)
+                for q in range(num_lay):
+                    #derivative of the layer matrix with respect to its thickness
+                    (d00,d01,d10,d11) = mat_mul(pre[q,0],pre[q,1],pre[q,2],pre[q,3],
+                        -dphi[q]*s[q],-1j*dphi[q]*c[q]/gam[rho,q],-1j*dphi[q]*c[q]*gam[rho,q],-dphi[q]*s[q])
+                    (d00,d01,d10,d11) = mat_mul(d00,d01,d10,d11,suf[q+1,0],suf[q+1,1],suf[q+1,2],suf[q+1,3])
+                    dnum = gammac*d00+gammac*gammas*d01-d10-gammas*d11
+                    dden = gammac*d00+gammac*gammas*d01+d10+gammas*d11
+                    dr[rho,q] = (dnum-r[rho]*dden)/den
+                    dt[rho,q] = -t[rho]*dden/den
+            #observables, same definitions as spectra
+            rho_ps = r[1]/r[0]
+            spec[0,j,i] = np.real(r[1])**2+np.imag(r[1])**2
+            spec[1,j,i] = np.real(r[0])**2+np.imag(r[0])**2
+            spec[2,j,i] = tfac[1]*(np.real(t[1])**2+np.imag(t[1])**2)
+            spec[3,j,i] = tfac[0]*(np.real(t[0])**2+np.imag(t[0])**2)
+            spec[4,j,i] = np.arctan(np.abs(rho_ps))*(180/np.pi)
+            spec[5,j,i] = (2*np.pi-np.imag(np.log(r[0]/r[1]))-(np.imag(rho_ps)))
+            for q in range(num_lay):
+                jac[0,j,i,q] = 2*np.real(np.conj(r[1])*dr[1,q])
+                jac[1,j,i,q] = 2*np.real(np.conj(r[0])*dr[0,q])
+                jac[2,j,i,q] = 2*tfac[1]*np.real(np.conj(t[1])*dt[1,q])
+                jac[3,j,i,q] = 2*tfac[0]*np.real(np.conj(t[0])*dt[0,q])
+                drho = (dr[1,q]-rho_ps*dr[0,q])/r[0]
+                jac[4,j,i,q] = (180/np.pi)*np.real(np.conj(rho_ps)*drho)/(np.abs(rho_ps)*(1+np.abs(rho_ps)**2))
+                jac[5,j,i,q] = -np.imag(dr[0,q]/r[0]-dr[1,q]/r[1])-np.imag(drho)
+    return (spec,jac)
+
+
+#Rp, Rs, Tp, Ts, Psi and Delta from the TE (0) and TM (1) reflection and transmission coefficients
+@jit(nopython=True)
+def observables(r0, r1, t0, t1, tfac0, tfac1):
+    rp = np.real(r1)**2+np.imag(r1)**2
+    rs = np.real(r0)**2+np.imag(r0)**2
+    tp = tfac1*(np.real(t1)**2+np.imag(t1)**2)
+    ts = tfac0*(np.real(t0)**2+np.imag(t0)**2)
+    psi = np.arctan(np.abs(r1/r0))*(180/np.pi)
+    delta = (2*np.pi-np.imag(np.log(r0/r1))-(np.imag(r1/r0)))
+    return (rp,rs,tp,ts,psi,delta)
+
+
+#characteristic matrix of a single layer for one polarization, as (m00, m01, m10, m11)
+@jit(nopython=True)
+def layer_matrix(rho, beta, k, n, l):
+    z0 = 376.730313667
+    cosang = np.sqrt(1-(beta/n)**2+0j)
+    alpha = n*cosang
+    phi = k*alpha*l
+    if rho == 0:
+        gamma = alpha/z0
+    else:
+        gamma = z0*cosang/n
+    c = np.cos(phi)
+    s = np.sin(phi)
+    return (c,-1j*s/gamma,-1j*s*gamma,c)
+
+
+#incremental TMM state for a stack in which one layer at a time is changed
+#(GA mutations, coordinate searches over the thickness of one layer, finite differences, grid sweeps)
+#keeps every layer matrix and the prefix and suffix partial products for both polarizations at every angle and wavelength,
+#so a stack with layer q replaced is pre[q] * M_q * suf[q+1]: one new layer matrix and two products per point
+#   ang, wave, n_cover, n_subst as in the batched kernels, n : (L,W) index of each layer, l : (L,) thicknesses [m]
+#returns state = (beta, k, gammac, gammas, tfac, mats, pre, suf)
+#   beta : (A,W), k : (W,), gammac/gammas/tfac : (2,A,W)
+#   mats : (2,A,W,L,4) layer matrices, pre/suf : (2,A,W,L+1,4) partial products, stored as [m00,m01,m10,m11]
+#   pre[...,q,:] is the product of layers 0..q-1 and suf[...,q,:] the product of layers q..L-1
+@jit(nopython=True)
+def stack_state(ang, wave, n, l, n_cover, n_subst):
+    z0 = 376.730313667
+    num_lay = l.size
+    beta = np.zeros((ang.size,wave.size),dtype=np.complex128)
+    k = 2*np.pi/wave
+    gammac = np.zeros((2,ang.size,wave.size),dtype=np.complex128)
+    gammas = np.zeros((2,ang.size,wave.size),dtype=np.complex128)
+    tfac = np.zeros((2,ang.size,wave.size))
+    mats = np.zeros((2,ang.size,wave.size,num_lay,4),dtype=np.complex128)
+    pre = np.zeros((2,ang.size,wave.size,num_lay+1,4),dtype=np.complex128)
+    suf = np.zeros((2,ang.size,wave.size,num_lay+1,4),dtype=np.complex128)
+    for j in range(ang.size):
+        for i in range(wave.size):
+            beta[j,i] = n_cover[i]*np.sin(ang[j]*np.pi/180)
+            cosc = np.cos(ang[j]*np.pi/180)
+            coss = np.sqrt(1-(beta[j,i]/n_subst[i])**2+0j)
+            gammac[0,j,i] = n_cover[i]*cosc/z0
+            gammas[0,j,i] = n_subst[i]*coss/z0
+            gammac[1,j,i] = z0*cosc/n_cover[i]
+            gammas[1,j,i] = z0*coss/n_subst[i]
+            for rho in range(2):
+                tfac[rho,j,i] = np.real(gammas[rho,j,i])/np.real(gammac[rho,j,i])
+                for q in range(num_lay):
+                    (mats[rho,j,i,q,0],mats[rho,j,i,q,1],mats[rho,j,i,q,2],mats[rho,j,i,q,3]) = layer_matrix(rho, beta[j,i], k[i], n[q,i], l[q])
+    state = (beta,k,gammac,gammas,tfac,mats,pre,suf)
+    update_products(state, 0, num_lay)
+    return state
+
+
+#recompute the prefix products from layer q0 on and the suffix products up to layer q1
+@jit(nopython=True)
+def update_products(state, q0, q1):
+    (beta,k,gammac,gammas,tfac,mats,pre,suf) = state
+    num_lay = mats.shape[3]
+    for rho in range(2):
+        for j in range(beta.shape[0]):
+            for i in range(beta.shape[1]):
+                m = mats[rho,j,i]
+                p = pre[rho,j,i]
+                u = suf[rho,j,i]
+                p[0,0] = 1.
+                p[0,3] = 1.
+                u[num_lay,0] = 1.
+                u[num_lay,3] = 1.
+                for q in range(q0,num_lay):
+                    (p[q+1,0],p[q+1,1],p[q+1,2],p[q+1,3]) = mat_mul(p[q,0],p[q,1],p[q,2],p[q,3],m[q,0],m[q,1],m[q,2],m[q,3])
+                for q in range(min(q1,num_lay)-1,-1,-1):
+                    (u[q,0],u[q,1],u[q,2],u[q,3]) = mat_mul(m[q,0],m[q,1],m[q,2],m[q,3],u[q+1,0],u[q+1,1],u[q+1,2],u[q+1,3])
+
+
+#spectra of the stack held in the state
+#returns (rp, rs, tp, ts, psi, delta) as (A,W) arrays
+@jit(nopython=True)
+def state_spectra(state):
+    (beta,k,gammac,gammas,tfac,mats,pre,suf) = state
+    num_lay = mats.shape[3]
+    out = np.zeros((6,beta.shape[0],beta.shape[1]))
+    for j in range(beta.shape[0]):
+        for i in range(beta.shape[1]):
+            m = pre[0,j,i,num_lay]
+            (r0,t0) = fresnel(gammac[0,j,i],gammas[0,j,i],m[0],m[1],m[2],m[3])
+            m = pre[1,j,i,num_lay]
+            (r1,t1) = fresnel(gammac[1,j,i],gammas[1,j,i],m[0],m[1],m[2],m[3])
+            (out[0,j,i],out[1,j,i],out[2,j,i],out[3,j,i],out[4,j,i],out[5,j,i]) = observables(r0,r1,t0,t1,tfac[0,j,i],tfac[1,j,i])
+    return (out[0],out[1],out[2],out[3],out[4],out[5])
+
+
+#spectra of the stack with layer q replaced by index n_q (W,) and thickness l_q, without changing the state
+#one layer matrix and two 2x2 products per point, independent of the number of layers
+#returns (rp, rs, tp, ts, psi, delta) as (A,W) arrays
+@jit(nopython=True)
+def perturb_spectra(state, q, n_q, l_q):
+    (beta,k,gammac,gammas,tfac,mats,pre,suf) = state
+    out = np.zeros((6,beta.shape[0],beta.shape[1]))
+    for j in range(beta.shape[0]):
+        for i in range(beta.shape[1]):
+            r = np.zeros(2,dtype=np.complex128)
+            t = np.zeros(2,dtype=np.complex128)
+            for rho in range(2):
+                (b00,b01,b10,b11) = layer_matrix(rho, beta[j,i], k[i], n_q[i], l_q)
+                p = pre[rho,j,i,q]
+                u = suf[rho,j,i,q+1]
+                (m00,m01,m10,m11) = mat_mul(p[0],p[1],p[2],p[3],b00,b01,b10,b11)
+                (m00,m01,m10,m11) = mat_mul(m00,m01,m10,m11,u[0],u[1],u[2],u[3])
+                (r[rho],t[rho]) = fresnel(gammac[rho,j,i],gammas[rho,j,i],m00,m01,m10,m11)
+            (out[0,j,i],out[1,j,i],out[2,j,i],out[3,j,i],out[4,j,i],out[5,j,i]) = observables(r[0],r[1],t[0],t[1],tfac[0,j,i],tfac[1,j,i])
+    return (out[0],out[1],out[2],out[3],out[4],out[5])
+
+
+#replace layer q of the stack held in the state by index n_q (W,) and thickness l_q
+#the state is updated in place: one new layer matrix, then only the prefix products after q and the suffix products up to q
+@jit(nopython=True)
+def update_layer(state, q, n_q, l_q):
+    (beta,k,gammac,gammas,tfac,mats,pre,suf) = state
+    for rho in range(2):
+        for j in range(beta.shape[0]):
+            for i in range(beta.shape[1]):
+                (mats[rho,j,i,q,0],mats[rho,j,i,q,1],mats[rho,j,i,q,2],mats[rho,j,i,q,3]) = layer_matrix(rho, beta[j,i], k[i], n_q[i], l_q)
+    update_products(state, q, q+1)
+
+
 #convert psi and delta into n and k values
 @jit(nopython=True)
 def ellip2nk(psi,delta,th,n_cover):
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#Lazy reader for the datasets written by the generation scripts
+#the file is opened once and every quantity is a view that reads only the rows that are indexed, so taking a few
+#thousand test examples out of a dataset of hundreds of thousands structures does not load the whole file
+#both layouts of the generation scripts are read:
+#   flat    : one 'data' array with a row [ang, mats of each layer, l, rp, rs, tp, ts, psi, delta] per structure
+#   columns : one dataset per quantity, mats as (N,L,M) and spectra as (N,A,W)
+#the views always give rows of the flat layout, e.g. rp as (n, num_ang*num_wave) flattened as [spec(ang1),spec(ang2),...]
+#
+#   data = DataSet(filename,num_mat,num_ang,num_lay,num_wave)
+#   rp = data.column('rp')            #nothing is read yet
+#   rp[220000:220100]                 #reads 100 rows of rp only
+#   (train,val,test) = data.split([0,200000,210000,220000])
+#   (psi,delta) = test.group('psi','delta')
+#   tr_p = spectra_tensor(train.column('psi'),num_ang,num_wave)   #(n,num_wave,num_ang) float32 for the CNNs
+#
+#the views can be pickled (e.g. sent to joblib workers), each process then reopens the file for itself
+
+import os
+import h5py
+import numpy as np
+
+columns = ['ang','mats','l','rp','rs','tp','ts','psi','delta']
+
+
+class DataSet:
+    #the sizes are only needed for flat files written before the sizes were stored in the file attributes
+    #start/stop restrict the dataset to a range of rows, see rows() and split()
+    def __init__(self, filename, nmat=None, nang=None, nlay=None, nwave=None, dtype=np.float64):
+        self.filename = filename
+        self.dtype = dtype
+        self._f = None
+        self._pid = None
+        f = self.file()
+        if 'data' in f:
+            self.layout = 'flat'
+            attrs = f.attrs
+            #sizes stored by the generation script win over the arguments
+            if 'ang' in attrs:
+                nang = np.size(attrs['ang'])
+            if 'wave' in attrs:
+                nwave = np.size(attrs['wave'])
+            if 'materials' in attrs:
+                nmat = len(np.bytes_(attrs['materials']).decode().split(','))
+            if 'num_lay' in attrs:
+                nlay = int(attrs['num_lay'])
+            if None in (nmat,nang,nlay,nwave):
+                raise ValueError('%s does not store its sizes, pass nmat, nang, nlay and nwave'%filename)
+            self.numrows = f['data'].shape[0]
+        else:
+            self.layout = 'columns'
+            (nlay,nmat) = f['mats'].shape[1:]
+            (nang,nwave) = f['rp'].shape[1:]
+            self.numrows = f['ang'].shape[0]
+        (self.nmat,self.nang,self.nlay,self.nwave) = (nmat,nang,nlay,nwave)
+        #column range of each quantity in a flat row
+        widths = [nang,nlay*nmat,nlay] + [nang*nwave]*6
+        edges = np.cumsum([0]+widths)
+        self.offsets = dict((name,(edges[i],edges[i+1])) for (i,name) in enumerate(columns))
+        if self.layout == 'flat' and f['data'].shape[1] != edges[-1]:
+            raise ValueError('%s has rows of %d values, expected %d for %d materials, %d angles, %d layers and %d wavelengths'
+                             %(filename,f['data'].shape[1],edges[-1],nmat,nang,nlay,nwave))
+        self.start = 0
+        self.stop = self.numrows
+
+    #the open h5py file, reopened after the dataset is pickled or the process is forked
+    def file(self):
+        if self._f is None or self._pid != os.getpid():
+            self._f = h5py.File(self.filename,'r')
+            self._pid = os.getpid()
+        return self._f
+
+    def close(self):
+        if self._f is not None and self._pid == os.getpid():
+            self._f.close()
+        self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_f'] = None
+        state['_pid'] = None
+        return state
+
+    def __len__(self):
+        return self.stop-self.start
+
+    #view of rows [start,stop) of this dataset, shares the open file
+    def rows(self, start, stop=None):
+        (start,stop,_) = slice(start,stop).indices(len(self))
+        view = DataSet.__new__(DataSet)
+        view.__dict__.update(self.__dict__)
+        view.start = self.start+start
+        view.stop = self.start+max(start,stop)
+        return view
+
+    #consecutive views between the row indices in bounds, e.g. split([0,tr,va,te]) -> (train,val,test)
+    def split(self, bounds):
+        return tuple(self.rows(bounds[i],bounds[i+1]) for i in range(len(bounds)-1))
+
+    #view of one quantity, transform (e.g. a rescaling fcn) is applied to every block that is read
+    def column(self, name, transform=None):
+        if name not in self.offsets:
+            raise KeyError('unknown quantity %s, expected one of %s'%(name,', '.join(columns)))
+        return Column(self, name, transform=transform)
+
+    #one-hot material vectors (n,nmat) of layer `layer` (from 0)
+    def mats(self, layer, transform=None):
+        if layer < 0 or layer >= self.nlay:
+            raise IndexError('layer %d out of range for %d layers'%(layer,self.nlay))
+        return Column(self, 'mats', layer=layer, transform=transform)
+
+    #views of several quantities at once, e.g. group('rp','rs','tp','ts')
+    def group(self, *names):
+        return tuple(self.column(name) for name in names)
+
+    #read rows [a,b) (absolute) of a quantity as a (b-a,width) array
+    def read(self, name, a, b, layer=None):
+        f = self.file()
+        if self.layout == 'flat':
+            (c0,c1) = self.offsets[name]
+            if layer is not None:
+                c0 += layer*self.nmat
+                c1 = c0+self.nmat
+            block = f['data'][a:b,c0:c1]
+        elif layer is not None:
+            block = f['mats'][a:b,layer,:]
+        else:
+            block = f[name][a:b]
+        return np.asarray(block,dtype=self.dtype).reshape(b-a,-1)
+
+    #read a sorted array of absolute rows, in contiguous runs so far apart rows do not read what lies between
+    def read_rows(self, name, idx, layer=None):
+        if idx.size == 0:
+            return self.read(name, 0, 0, layer)
+        cuts = np.nonzero(np.diff(idx) != 1)[0]+1
+        starts = np.concatenate(([0],cuts))
+        stops = np.concatenate((cuts,[idx.size]))
+        return np.concatenate([self.read(name, idx[s], idx[e-1]+1, layer) for (s,e) in zip(starts,stops)])
+
+
+class Column:
+    #lazy view of one quantity of a DataSet, indexed like the (n,width) array it stands for
+    def __init__(self, data, name, layer=None, transform=None):
+        self.data = data
+        self.name = name
+        self.layer = layer
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def shape(self):
+        if self.layer is not None:
+            return (len(self),self.data.nmat)
+        (c0,c1) = self.data.offsets[self.name]
+        return (len(self),int(c1-c0))
+
+    @property
+    def ndim(self):
+        return 2
+
+    #view of rows [start,stop) of this quantity
+    def rows(self, start, stop=None):
+        return Column(self.data.rows(start,stop), self.name, self.layer, self.transform)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        (rows,rest) = (key[0],key[1:])
+        n = len(self)
+        scalar = isinstance(rows, (int,np.integer))
+        if isinstance(rows, slice):
+            (a,b,s) = rows.indices(n)
+            if s == 1:
+                block = self.data.read(self.name, self.data.start+a, self.data.start+max(a,b), self.layer)
+                idx = None
+            else:
+                idx = np.arange(a,b,s)
+        else:
+            idx = np.arange(n)[rows]
+        if idx is not None:
+            idx = np.atleast_1d(idx)
+            (uniq,inv) = np.unique(idx, return_inverse=True)
+            block = self.data.read_rows(self.name, uniq+self.data.start, self.layer)[inv]
+        if self.transform is not None:
+            block = self.transform(block)
+        if scalar:
+            return block[0][rest]
+        return block[(slice(None),)+rest]
+
+    def __array__(self, dtype=None):
+        block = self[:]
+        return block if dtype is None else block.astype(dtype)
+
+
+#spectra rows (n,nang*nwave) flattened as [spec(ang1),spec(ang2),...] as the (n,nwave,nang) tensor taken by the CNNs
+#rows is an array or a Column, it is converted chunk_rows rows at a time with one reshape/transpose per chunk so
+#the flat rows of a Column are never all in memory. The tensor is written into out when given (a preallocated
+#(n,nwave,nang) buffer, e.g. float32), a new array of type dtype is returned otherwise
+def spectra_tensor(rows, nang, nwave, out=None, dtype=np.float32, chunk_rows=8192):
+    n = len(rows)
+    if out is None:
+        out = np.empty((n,nwave,nang),dtype=dtype)
+    elif out.shape != (n,nwave,nang):
+        raise ValueError('out has shape %s, expected %s'%(out.shape,(n,nwave,nang)))
+    for a in range(0,n,chunk_rows):
+        b = min(a+chunk_rows,n)
+        out[a:b] = np.asarray(rows[a:b]).reshape(b-a,nang,nwave).transpose(0,2,1)
+    return out
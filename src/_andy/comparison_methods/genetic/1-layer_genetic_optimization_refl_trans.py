@@ -6,6 +6,13 @@ import numpy as np
 import TMM_numba as tmm
 from scipy.optimize import least_squares
 import h5py
+import data_reader as rdr
+import ga_surrogate as sg
+import ga_cache as fc
+import ga_selection as gs
+import ga_islands as gi
+import de_mixed as dm
+import ga_stop as cv
 import BB_metals as bb
 import dielectric_materials as di
 from joblib import Parallel, delayed
@@ -40,6 +47,7 @@ materials = np.array([ag,al2o3,ito,au,tio2])
 #substrate and superstrate for the materials stack (1. = Void)
 n_subst = gl
 n_super = 1.
+n_cover = n_super*np.ones(wave.size,dtype=np.complex128) #cover index at each wavelength for the batched TMM kernels
 
 #model info taken from the data generation script
 #this is to ensure the optimization is constrained to the same domain as probed by the CNN model
@@ -74,35 +82,17 @@ def resc_delt(in_delt):
 #funciton to read in data produced by the generation script 
 #optimizaion acts on spectra in the CNN test dataset
 def readin_data(filename,nmat,nang,nlay,nwave):
-    f = h5py.File(filename,'r')
-    arrd = np.array(f.get('data'))
-    itl=0
-    ith=nang
-    theta = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nmat
-    ml1 = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nlay
-    th = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    rp = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    rs = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    tp = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    ts = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    psi = (arrd[:,itl:ith])
-    itl=ith
-    delta = (arrd[:,itl:])
-    f.close()
+    #lazy views of the dataset: rows are read from the file only when they are indexed (see data_reader.py)
+    data = rdr.DataSet(filename,nmat,nang,nlay,nwave)
+    theta = data.column('ang')
+    ml1 = data.mats(0)
+    th = data.column('l')
+    rp = data.column('rp')
+    rs = data.column('rs')
+    tp = data.column('tp')
+    ts = data.column('ts')
+    psi = data.column('psi')
+    delta = data.column('delta')
     return (ml1,th,theta,rp,rs,tp,ts,psi,delta)
 
 #simple well in 2d, this can be used to test the ability of the script to find a global minimum
@@ -146,24 +136,26 @@ def residuals_fcn_rt(x,n,rp,rs,tp,ts):
 
 #calulates the fitness for the current population
 #fitness is calculated as the -MSE between the spectra produced by the optimized materials and the target spectra
+#the whole population is simulated in one call of the batched TMM kernel, the (individual, wavelength) pairs are
+#split over threads (see threads) and only the MSE of each individual is kept, not its spectra
+#the table of materials (M,W) is an argument, the island model reads it from shared memory
 @jit(nopython=True)
-def calcFit(newPop,rp,rs,tp,ts):
-    fit = np.zeros(newPop.shape[0])
-    n = np.zeros((num_lay,wave.size),dtype = np.complex128)
-    #loop over population
-    for i in range(newPop.shape[0]):
-        l = newPop[i,:num_lay]
-        mat = newPop[i,num_lay:]
-        for j in range(num_lay):
-            n[j,:] = materials[np.int(mat[j])]
-        #calc output for all angles
-        mse = -1*np.mean(np.square(residuals_fcn_rt(l,n,rp,rs,tp,ts)))
-        fit[i] = mse
-        #this is where the test well is inserted into the code for testing the optimzation
-        #change the dimensionality of the well as needed
-        #fit[i] = -1*np.sum(np.square(test_well(l)))/3
+def calcFit_table(newPop,table,rp,rs,tp,ts):
+    l = transform(newPop[:,:num_lay])
+    #(P,L,W) index of refraction of every layer of every individual, gathered from the material genes
+    n = tmm.gather_index(table,newPop[:,num_lay:])
+    #only the reflectance spectra are fitted (rp and rs), as in residuals_fcn_rt
+    fit = -1*tmm.mse_batch_par(ang,wave,n,l,n_cover,n_subst,np.array([0,1]),np.stack((rp,rs)))
+    #this is where the test well is inserted into the code for testing the optimzation
+    #change the dimensionality of the well as needed
+    #fit = -1*np.sum(np.square(test_well(newPop[:,:num_lay].T)),axis=0)/3
     return fit
 
+#fitness with the table of materials of this script
+@jit(nopython=True)
+def calcFit(newPop,rp,rs,tp,ts):
+    return calcFit_table(newPop,materials,rp,rs,tp,ts)
+
 #generate a population with random mutations in thickness and materials
 #the frequency of these mutations can be tuned as needed.
 @jit(nopython=True)
@@ -183,17 +175,11 @@ def mutation(offCross):
     return offCross
 
 
-#choose the most fit individuals to be parents
-#the number of mating parents is given by numMating
-@jit(nopython=True)
+#choose the parents from the population
+#the number of mating parents is given by numMating, the operator by selection (see ga_selection.py)
+#'argmax' is the original choice of the most fit individuals by repeated argmax, 'truncation' gives the same parents in linear time
 def matingPool(newPop,fit,numMating):
-    parents = np.empty((numMating,newPop.shape[1]))
-    for parent in range(numMating):
-        max_fit = np.argmax(fit)
-        parents[parent,:] = newPop[max_fit,:]
-        #reasign the chosen individual to a terrible fitness
-        fit[max_fit] = -99999999999999
-    return parents
+    return gs.select(newPop,fit,numMating,gs.methods[selection],tsize)
         
 #crossover genes between 2 parents
 #the layer thickness and materials are co-dependent, since a change in materials moves to a new subspace, thus the crossover is my layer and thickness / material pairs are maintained
@@ -209,10 +195,34 @@ def crossover(parents,offSize):
     return off
 
     
+#fitness of a population through the fitness cache (see ga_cache.py)
+#only the individuals that were not simulated before for this target are passed to calcFit
+def cachedFit(newPop,rp,rs,tp,ts):
+    return fitcache.fitness(newPop,lambda pop: calcFit(pop,rp,rs,tp,ts),num_lay,transform)
+
+#next generation of a population with fitness fit, the population array is updated in place
+#used by history, history_surrogate and the islands of the island model
+def breed(newPop,fit):
+    #select parents from the population
+    parents = matingPool(newPop,fit,numMating)
+    parShape = parents.shape
+    #offspring make up the remainder of the population.
+    #perform the crossover and mutation for the offspring
+    offSize = (popSize[0] - parShape[0],popSize[1])
+    offCross = crossover(parents,offSize)
+    offMutat = mutation(offCross)
+    #new population contains both parents and offspring
+    newPop[:parShape[0],:] = parents
+    newPop[parShape[0]:,:] = offMutat
+    return newPop
+
 #function to perform the genetic evolution of the population
 #you need to input the number of individuals in the population and the target spectra
 #returns the optimized population and the history of the most fit individual in each generation
-@jit(nopython=True)
+#python loop around the compiled operators so the fitness can go through the cache, the parents and the unchanged
+#population evaluated a second time in each generation are not simulated again
+#the evolution stops before numGen generations when it has converged (see ga_stop.py), the generations not run keep
+#the last fitness in the history and the number of generations run is recorded in convergence
 def history(solPerPop,rp,rs,tp,ts):
     #create an initial population with solPerPop individuals
     #the normal distribution with s=0.85 is 'roughly' a uniform distribution after the tanh transformation is performed
@@ -221,26 +231,22 @@ def history(solPerPop,rp,rs,tp,ts):
     iniPop = np.concatenate((thicks,mats),axis=1)
     newPop = iniPop
     hist = np.zeros(numGen)
-    #evolve the population for numGen generations
+    reason = None
+    #evolve the population for at most numGen generations
     for gen in range(numGen):
         #calculate initial fitness
-        fit = calcFit(newPop,rp,rs,tp,ts)
-        #select parents from the population
-        parents = matingPool(newPop,fit,numMating)
-        parShape = parents.shape
-        #offspring make up the remainder of the population.
-        #perform the crossover and mutation for the offspring
-        offSize = (popSize[0] - parShape[0],popSize[1])
-        offCross = crossover(parents,offSize)
-        offMutat = mutation(offCross)
-        #new population contains both parents and offspring
-        newPop[:parShape[0],:] = parents
-        newPop[parShape[0]:,:] = offMutat
+        fit = cachedFit(newPop,rp,rs,tp,ts)
+        newPop = breed(newPop,fit)
         #history of the population fitness
-        fit = calcFit(newPop,rp,rs,tp,ts)
+        fit = cachedFit(newPop,rp,rs,tp,ts)
         #this is nice to show in real time how the population is evolving
         #print('Gen',gen,' max: ',np.max(fit), newPop[np.argmax(fit),:])
         hist[gen] = np.max(fit)
+        reason = convergence.check(hist[:gen+1],newPop,fit,num_lay,transform,trange)
+        if reason is not None:
+            hist[gen+1:] = hist[gen]
+            break
+    convergence.record(gen+1,reason)
     return (hist,newPop)
         
 
@@ -248,24 +254,88 @@ def history(solPerPop,rp,rs,tp,ts):
 #opimizes the population and calculates optimum fitness
 #returns the most fit individual and the max and std from the population
 #the best best individual is the optimization target
-@jit(nopython=True)
 def gen_fcn(rp,rs,tp,ts,solPerPop):
     (hist,optPop) = history(solPerPop,rp,rs,tp,ts)
-    optFit = calcFit(optPop,rp,rs,tp,ts)
+    optFit = cachedFit(optPop,rp,rs,tp,ts)
     best = optPop[np.argmax(optFit),:]
     best[:num_lay] = transform(best[:num_lay])
     return np.concatenate((best,np.array([np.max(optFit)]),np.array([np.std(optFit)])))
 
+#evolution with the population fitness screened by the surrogate model (see ga_surrogate.py)
+#same operators as history, but only the best confirm fraction of each population on the surrogate is simulated
+#with the TMM. Runs as a python loop since the network cannot be called from numba, the operators are still compiled
+#returns the history, the final population with its fitness and the mask of the exactly evaluated individuals
+def history_surrogate(solPerPop,rp,rs,tp,ts):
+    exact_fcn = lambda pop: cachedFit(pop,rp,rs,tp,ts)
+    thicks = np.random.normal(0,0.85,size = (solPerPop,num_lay))
+    mats = np.random.randint(0,num_mat,size = (solPerPop,num_lay))
+    newPop = np.concatenate((thicks,mats),axis=1)
+    hist = np.zeros(numGen)
+    reason = None
+    #the fitness of each population is kept for the selection of the next generation, so it is screened once per generation
+    (fit,mask) = sg.screened_fit(newPop,exact_fcn,surrogate,(rp,rs),('rp','rs'),num_lay,num_mat,transform,confirm)
+    for gen in range(numGen):
+        newPop = breed(newPop,fit)
+        (fit,mask) = sg.screened_fit(newPop,exact_fcn,surrogate,(rp,rs),('rp','rs'),num_lay,num_mat,transform,confirm)
+        #the confirmed individuals are always the most fit, so this is an exact fitness
+        hist[gen] = np.max(fit)
+        #same early stopping as history
+        reason = convergence.check(hist[:gen+1],newPop,fit,num_lay,transform,trange)
+        if reason is not None:
+            hist[gen+1:] = hist[gen]
+            break
+    convergence.record(gen+1,reason)
+    return (hist,newPop,fit,mask)
+
+#generation function for the surrogate screened evolution, same output as gen_fcn
+#the std is taken over the exactly evaluated individuals only
+def gen_fcn_surrogate(rp,rs,tp,ts,solPerPop):
+    (hist,optPop,optFit,mask) = history_surrogate(solPerPop,rp,rs,tp,ts)
+    best = optPop[np.argmax(optFit),:]
+    best[:num_lay] = transform(best[:num_lay])
+    return np.concatenate((best,np.array([np.max(optFit)]),np.array([np.std(optFit[mask])])))
+
+#island model evolution of one system (see ga_islands.py), islands populations of solPerPop evolve on separate cores
+#with the operators and fitness of history and exchange their best individuals every migrate generations
+#same output as gen_fcn, the std is taken over the best fitness of each island, followed by the generation reached
+def gen_fcn_islands(rp,rs,tp,ts,solPerPop):
+    #runs in each island after the fork, the cache copied from this process belongs to another target
+    def init():
+        fitcache.clear()
+        tmm.set_threads(threads)
+        thicks = np.random.normal(0,0.85,size = (solPerPop,num_lay))
+        mats = np.random.randint(0,num_mat,size = (solPerPop,num_lay))
+        return np.concatenate((thicks,mats),axis=1)
+    fitness = lambda pop,table: fitcache.fitness(pop,lambda p: calcFit_table(p,table,rp,rs,tp,ts),num_lay,transform)
+    (best,bestFit,islandFit,stop) = gi.run_islands(islands,init,fitness,breed,materials,numGen,migrate,migrants,patience,plateau_tol)
+    best[:num_lay] = transform(best[:num_lay])
+    return np.concatenate((best,np.array([bestFit]),np.array([np.std(islandFit)]),np.array([stop])))
+
+#mixed integer differential evolution of one system (see de_mixed.py), with at most budget structures simulated
+#same output as gen_fcn, except that the last value is the number of structures simulated instead of the std
+def gen_fcn_de(rp,rs,tp,ts,budget):
+    (best,bestFit,evals) = dm.optimize(lambda pop: calcFit(pop,rp,rs,tp,ts),num_lay,num_mat,int(budget),de_pop,de_eta,de_F,de_CR)
+    best[:num_lay] = transform(best[:num_lay])
+    return np.concatenate((best,np.array([bestFit]),np.array([evals])))
+
 #creates an ensemble of several initial populations and returns optimized populations for each
 #the ensemble. can be useful for generating statistics on the obtained optima and a range of optimization times
 #returns the best individual overall, the std in fitness for the best from all popuations and the program runtime
-def ensemble_fcn(solPerPop,rp,rs,tp,ts,ensemble,g):
+#fcn is gen_fcn for the exact GA, gen_fcn_surrogate for the surrogate screened GA or gen_fcn_de (solPerPop is then the budget)
+def ensemble_fcn(solPerPop,rp,rs,tp,ts,ensemble,g,fcn=gen_fcn):
     results = np.zeros((ensemble,numParams+2))
     #put the actual evolution in a try loop in case the program encounters an exception
     try:
+        #the surrogate model is loaded before the timing starts
+        if fcn is gen_fcn_surrogate:
+            sg.load_model(surrogate)
+        tmm.set_threads(threads)
+        #the cache is only valid for one target
+        fitcache.clear()
+        convergence.clear()
         start = datetime.datetime.now()
         for k in range(ensemble):
-            results[k,:] = gen_fcn(rp,rs,tp,ts,solPerPop)
+            results[k,:] = fcn(rp,rs,tp,ts,solPerPop)
         end = datetime.datetime.now()
         best = results[np.argmax(results[:,-2]),:]
         #sys_runtime is used for comparison, is the time to calculate the results for n number of individual populations and save the results
@@ -277,7 +347,8 @@ def ensemble_fcn(solPerPop,rp,rs,tp,ts,ensemble,g):
         sys_runtime = (datetime.datetime.now()-datetime.datetime.now())
         #check logfile for this error message...
         print('Error in Sys #',g)
-    return np.concatenate((best,np.array([np.std(results[:,-2])]),np.array([sys_runtime.seconds+sys_runtime.microseconds*1E-6]).astype('float')))
+    #mean generations run by the populations (nan for gen_fcn_de), fitness cache hits and lookups of the system are saved before the ensemble std
+    return np.concatenate((best,np.array([convergence.mean_gens()]),np.array([fitcache.hits,fitcache.lookups]),np.array([np.std(results[:,-2])]),np.array([sys_runtime.seconds+sys_runtime.microseconds*1E-6]).astype('float')))
 
 #Accuracy for materials and thickness MSE metrics
 #compared to the data generation materials and thicknesses
@@ -308,6 +379,51 @@ numGen = 30 # number of generations for the population (~30 reaches a local maxi
 sample = int(cores) #different systems to probe (n*cores is a good idea for the parallelization)
 offset = 220000 #makes sure you are looking at the CNN test portion of the dataset
 ensemble = 3 #distinct populations per system (min 3 for the std statistic)
+threads = 1 #threads of the population fitness in each worker, 1 since every core already runs a system. Raise it (and lower n_jobs) for large populations
+selection = 'truncation' #parent selection: 'argmax' (original), 'truncation', 'tournament', 'rank' or 'sus'
+tsize = 2 #individuals per tournament for selection = 'tournament'
+
+#fitness cache (see ga_cache.py), individuals already simulated for the current target are not simulated again
+#at most cache_size individuals are kept, thicknesses are compared to cache_quantum meters (0 disables the cache)
+cache_size = 100000
+cache_quantum = 1E-12
+fitcache = fc.FitnessCache(cache_size,cache_quantum)
+
+#early stopping (see ga_stop.py), numGen is the maximum number of generations. A population stops when its best fitness
+#improved by less than stop_tol (relative) over the last stop_window generations, when its diversity falls below
+#stop_div or when its best RMSE reaches stop_rmse (0 disables a criterion)
+stop_window = 10
+stop_tol = 1E-4
+stop_div = 1E-3
+stop_rmse = 0.
+convergence = cv.Convergence(stop_window,stop_tol,stop_div,stop_rmse)
+
+#island model (see ga_islands.py), islands populations evolve at the same time on separate cores and send their
+#migrants best individuals to the next island every migrate generations. The evolution stops when the best fitness
+#improved by less than plateau_tol (relative) over patience migrations. When islands > 1 the same systems are
+#optimized one after the other with the island model and compared to the independent populations of the ensemble
+islands = 0 #e.g. cores
+migrate = 5
+migrants = 2
+patience = 2
+plateau_tol = 1E-3
+#the islands are forked, the parallel kernels must run on a threading layer that can be forked (see ga_islands.py)
+if islands > 1:
+    gi.fork_safe_threading()
+
+#mixed integer differential evolution (see de_mixed.py), when de_compare is True the same systems are optimized with
+#it, each population getting the number of structures the GA simulated for that system (its fitness cache misses)
+de_compare = False
+de_pop = 8 #individuals per material subspace
+de_eta = 2 #1/de_eta of the subspaces are kept at each round of the successive halving
+de_F = 0.7 #DE differential weight
+de_CR = 0.9 #DE crossover probability
+
+#surrogate screening (see ga_surrogate.py)
+#model file trained with CNNs/structure2spectra for this layer number, None runs the exact GA only
+#when given, the same systems are optimized a second time with the surrogate screened GA and both are compared
+surrogate = None
+confirm = 0.2 #fraction of each population simulated with the TMM after ranking with the surrogate
 
 #initialization of Numba functions, just let this part run and do not save output
 #helps make runtume faster for actual optimization
@@ -339,7 +455,7 @@ print('Runtime: ',(end-start))
 filename = dr_save+'genetic_fitresults_1l5m_rprs_'+str(offset)+'-'+str(offset+sample)+'_'+'pop-'+str(solPerPop)+'gen-'+str(numGen)+'ens-'+str(ensemble)+'_'+start.strftime('%y')+start.strftime('%m')+start.strftime('%d')+'_'+start.strftime('%H')+start.strftime('%M')+start.strftime('%S')
 print(filename)
 #save the genetic results to a file
-#contians the [optimized material parameters, std over the ensemble, and system runtime] for each system considered
+#contians the [optimized material parameters, generations run, fitness cache hits and lookups, std over the ensemble, and system runtime] for each system considered
 np.savetxt(filename+'.txt', datasave,delimiter=',')
 
 #calculate the statistics for genetic output vs ground truth (spectral RMSE, materials accuracy, layer thickness RMSE)
@@ -358,9 +474,88 @@ stime = np.std(datasave[:,-1])
 print('Metrics: ',met)
 print('RMSE   : ',mfit,sfit)
 print('Ens STD: ',np.mean(datasave[:,-2]))
+print('Gens   : ',np.mean(datasave[:,-5])) #generations run per population, numGen if it never converged
+print('Cache  : ',np.sum(datasave[:,-4])/np.sum(datasave[:,-3])) #fraction of the fitness evaluations taken from the cache
 print('Time   : ',mtime,stime)
 #save the results in individual txt files
 np.savetxt(filename+'_metrics.txt',met)
 np.savetxt(filename+'_statistics.txt',np.concatenate((met[0,:],met[1,:],np.array([mfit,sfit,mtime,stime]))),delimiter=',')
 
-
+#surrogate screened GA on the same systems, compared to the exact GA above
+if surrogate is not None:
+    print('------Surrogate, confirm:%.2f------'%(confirm))
+    start_s = datetime.datetime.now()
+    results_s = Parallel(n_jobs=cores,verbose=10)(delayed(ensemble_fcn)(solPerPop,trp[g,:],trs[g,:],ttp[g,:],tts[g,:],ensemble,g,gen_fcn_surrogate) for g in range(offset,sample+offset))
+    print('Runtime: ',(datetime.datetime.now()-start_s))
+    datasave_s = np.array(results_s)
+    np.savetxt(filename+'_surrogate.txt', datasave_s,delimiter=',')
+    met_s = accutest(tm,tt,datasave_s[:,num_lay:2*num_lay],datasave_s[:,:num_lay])
+    mfit_s = np.mean(np.sqrt(-datasave_s[:,2*num_lay]))
+    sfit_s = np.std(np.sqrt(-datasave_s[:,2*num_lay]))
+    mtime_s = np.mean(datasave_s[:,-1])
+    stime_s = np.std(datasave_s[:,-1])
+    #TMM evaluations per system: structures simulated by the exact GA vs the surrogate screened GA (fitness cache misses)
+    tmm_exact = np.mean(datasave[:,-3]-datasave[:,-4])
+    tmm_surr = np.mean(datasave_s[:,-3]-datasave_s[:,-4])
+    print('Metrics: ',met_s)
+    print('RMSE   : ',mfit_s,sfit_s)
+    print('Ens STD: ',np.mean(datasave_s[:,-2]))
+    print('Gens   : ',np.mean(datasave_s[:,-5]))
+    print('Cache  : ',np.sum(datasave_s[:,-4])/np.sum(datasave_s[:,-3]))
+    print('Time   : ',mtime_s,stime_s)
+    print('TMM    : ',tmm_exact,tmm_surr)
+    #speedup of the per system runtime and change of the spectral RMSE (positive is a loss of accuracy)
+    print('Speedup: ',mtime/mtime_s)
+    print('dRMSE  : ',mfit_s-mfit)
+    np.savetxt(filename+'_surrogate_metrics.txt',met_s)
+    np.savetxt(filename+'_surrogate_statistics.txt',np.concatenate((met_s[0,:],met_s[1,:],np.array([mfit_s,sfit_s,mtime_s,stime_s,mtime/mtime_s,mfit_s-mfit]))),delimiter=',')
+
+#island model GA on the same systems, compared to the independent populations of the ensemble above
+if islands > 1:
+    print('------Islands:%d, migration every %d generations------'%(islands,migrate))
+    results_i = []
+    for g in range(offset,sample+offset):
+        start_i = datetime.datetime.now()
+        res = gen_fcn_islands(trp[g,:],trs[g,:],ttp[g,:],tts[g,:],solPerPop)
+        sys_runtime = datetime.datetime.now()-start_i
+        results_i.append(np.concatenate((res,np.array([sys_runtime.seconds+sys_runtime.microseconds*1E-6]))))
+    #[optimized material parameters, fitness, std over the islands, generation reached, system runtime] for each system
+    datasave_i = np.array(results_i)
+    np.savetxt(filename+'_islands.txt', datasave_i,delimiter=',')
+    met_i = accutest(tm,tt,datasave_i[:,num_lay:2*num_lay],datasave_i[:,:num_lay])
+    mfit_i = np.mean(np.sqrt(-datasave_i[:,2*num_lay]))
+    sfit_i = np.std(np.sqrt(-datasave_i[:,2*num_lay]))
+    mtime_i = np.mean(datasave_i[:,-1])
+    stime_i = np.std(datasave_i[:,-1])
+    print('Metrics: ',met_i)
+    print('RMSE   : ',mfit_i,sfit_i)
+    print('Isl STD: ',np.mean(datasave_i[:,-3]))
+    print('Gens   : ',np.mean(datasave_i[:,-2])) #generation reached, numGen if the fitness never reached a plateau
+    print('Time   : ',mtime_i,stime_i)
+    #wall-clock per system and core seconds per system (the ensemble runs on one core, the islands on islands cores)
+    print('Wall   : ',mtime,mtime_i)
+    print('Cores s: ',mtime,mtime_i*islands)
+    np.savetxt(filename+'_islands_metrics.txt',met_i)
+    np.savetxt(filename+'_islands_statistics.txt',np.concatenate((met_i[0,:],met_i[1,:],np.array([mfit_i,sfit_i,mtime_i,stime_i,np.mean(datasave_i[:,-2])]))),delimiter=',')
+
+#differential evolution on the same systems with the TMM budget of the GA above
+if de_compare:
+    #structures simulated per GA population of each system, fitness cache lookups-hits over the ensemble
+    budgets = (datasave[:,-3]-datasave[:,-4])/ensemble
+    print('------Differential evolution, budget:%d------'%(np.mean(budgets)))
+    results_d = Parallel(n_jobs=cores,verbose=10)(delayed(ensemble_fcn)(budgets[g-offset],trp[g,:],trs[g,:],ttp[g,:],tts[g,:],ensemble,g,gen_fcn_de) for g in range(offset,sample+offset))
+    datasave_d = np.array(results_d)
+    np.savetxt(filename+'_de.txt', datasave_d,delimiter=',')
+    met_d = accutest(tm,tt,datasave_d[:,num_lay:2*num_lay],datasave_d[:,:num_lay])
+    mfit_d = np.mean(np.sqrt(-datasave_d[:,2*num_lay]))
+    sfit_d = np.std(np.sqrt(-datasave_d[:,2*num_lay]))
+    mtime_d = np.mean(datasave_d[:,-1])
+    stime_d = np.std(datasave_d[:,-1])
+    print('Metrics: ',met_d)
+    print('RMSE   : ',mfit_d,sfit_d)
+    print('Time   : ',mtime_d,stime_d)
+    print('TMM    : ',np.mean(budgets),np.mean(datasave_d[:,2*num_lay+1])) #structures simulated per population, GA and DE
+    #change of the spectral RMSE at the same number of structures simulated (negative is better than the GA)
+    print('dRMSE  : ',mfit_d-mfit)
+    np.savetxt(filename+'_de_metrics.txt',met_d)
+    np.savetxt(filename+'_de_statistics.txt',np.concatenate((met_d[0,:],met_d[1,:],np.array([mfit_d,sfit_d,mtime_d,stime_d,mfit_d-mfit]))),delimiter=',')
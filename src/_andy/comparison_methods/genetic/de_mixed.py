@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#Mixed integer differential evolution for the inverse design problem
+#the materials are discrete and the thicknesses continuous, so every material combination (subspace) gets its own
+#small differential evolution population over the thickness genes (the same tanh space as the genetic algorithm,
+#thickness = transform(gene)). Subspaces are pruned with successive halving, a bandit allocation of the evaluations:
+#all subspaces start with npop random individuals, then in each round the surviving subspaces share the same part of
+#the budget and only the best 1/eta of them (on their best fitness) go to the next round, until one is left.
+#if there are more subspaces than half the budget can start, a random sample of them is used.
+#the DE step is current-to-best/1/bin, done for all surviving subspaces at once so each generation is one call of the
+#population fitness (calcFit of the genetic scripts).
+#
+#   (best,bestFit,evals) = optimize(lambda pop: calcFit(pop,rp,rs,tp,ts),num_lay,num_mat,budget)
+#       best is [thickness genes, material genes] (apply transform to the thickness genes), evals <= budget structures
+
+import itertools
+import numpy as np
+
+
+#fitness of the individuals X (A,npop,L) of subspaces mats (A,L), as the genetic algorithm populations
+def evaluate(fitness_fcn, X, mats):
+    (A,N,L) = X.shape
+    pop = np.concatenate((X.reshape(A*N,L),np.repeat(mats,N,axis=0).astype(np.float64)),axis=1)
+    return np.asarray(fitness_fcn(pop)).reshape(A,N)
+
+
+#one current-to-best/1/bin generation of every subspace, a trial replaces its parent if it is at least as fit
+def de_step(fitness_fcn, X, fit, mats, F, CR):
+    (A,N,L) = X.shape
+    a = np.arange(A)[:,None]
+    i = np.arange(N)[None,:]
+    best = X[np.arange(A),np.argmax(fit,axis=1)][:,None,:]
+    #two other members of the same subspace, different from each other (no difference vector below 3 members)
+    if N < 3:
+        r1 = r2 = np.broadcast_to(i,(A,N))
+    else:
+        o1 = np.random.randint(1,N,size=(A,N))
+        o2 = np.random.randint(1,N-1,size=(A,N))
+        o2 += o2 >= o1
+        (r1,r2) = ((i+o1)%N,(i+o2)%N)
+    V = X+F*(best-X)+F*(X[a,r1]-X[a,r2])
+    #binomial crossover, at least one gene from the mutant
+    mask = np.random.rand(A,N,L) < CR
+    mask[a,i,np.random.randint(0,L,size=(A,N))] = True
+    U = np.where(mask,V,X)
+    fitU = evaluate(fitness_fcn, U, mats)
+    better = fitU >= fit
+    X = np.where(better[:,:,None],U,X)
+    fit = np.where(better,fitU,fit)
+    return (X,fit)
+
+
+#material subspaces to start with, all of them or a random sample of size narms
+def subspaces(num_lay, num_mat, narms):
+    total = num_mat**num_lay
+    if narms >= total:
+        return np.array(list(itertools.product(range(num_mat),repeat=num_lay)))
+    codes = np.random.choice(total,narms,replace=False)
+    return np.array([(codes//num_mat**k)%num_mat for k in range(num_lay-1,-1,-1)]).T
+
+
+#optimize with at most budget structures simulated
+#npop individuals per subspace (at most budget), 1/eta of the subspaces kept each round, F and CR the DE weight and
+#crossover rate
+def optimize(fitness_fcn, num_lay, num_mat, budget, npop=8, eta=2, F=0.7, CR=0.9):
+    if budget < 1:
+        raise ValueError('budget must be at least 1, got %d'%budget)
+    npop = min(npop,budget)
+    narms = max(1,min(num_mat**num_lay,budget//(2*npop)))
+    mats = subspaces(num_lay, num_mat, narms)
+    #the same initial distribution as the genetic algorithm, roughly uniform after the tanh transformation
+    X = np.random.normal(0,0.85,size=(mats.shape[0],npop,num_lay))
+    fit = evaluate(fitness_fcn, X, mats)
+    evals = X.shape[0]*npop
+    rounds = int(np.ceil(np.log(mats.shape[0])/np.log(eta))) if mats.shape[0] > 1 else 0
+    for r in range(rounds+1):
+        A = X.shape[0]
+        #the remaining budget is shared equally by the remaining rounds
+        gens = int((budget-evals)/(rounds+1-r))//(A*npop)
+        for gen in range(gens):
+            (X,fit) = de_step(fitness_fcn, X, fit, mats, F, CR)
+            evals += A*npop
+        if r < rounds:
+            keep = np.argsort(-np.max(fit,axis=1))[:max(1,int(np.ceil(A/eta)))]
+            (X,fit,mats) = (X[keep],fit[keep],mats[keep])
+    (k,j) = np.unravel_index(np.argmax(fit),fit.shape)
+    best = np.concatenate((X[k,j],mats[k].astype(np.float64)))
+    return (best,fit[k,j],evals)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#Fitness cache of the genetic algorithm
+#the parents are copied unchanged into the next generation and the fittest individuals survive for many generations,
+#so most of a population has been simulated before. The fitness of every simulated individual is kept under a key
+#made of its quantized genes (thicknesses after the tanh transform rounded to quantum meters, material numbers) and
+#only individuals that were never seen are simulated, duplicates in a population are simulated once.
+#the cache holds at most size individuals, the least recently used are dropped first.
+#
+#   fitcache = FitnessCache(size=100000,quantum=1E-12)
+#   fit = fitcache.fitness(newPop,lambda pop: calcFit(pop,rp,rs,tp,ts),num_lay,transform)
+#   fitcache.hits/fitcache.lookups
+#
+#the fitness depends on the target spectra, clear the cache when the target changes
+
+from collections import OrderedDict
+import numpy as np
+
+
+class FitnessCache:
+    #size = 0 disables the cache, every individual is simulated
+    def __init__(self, size=100000, quantum=1E-12):
+        self.size = size
+        self.quantum = quantum
+        self.table = OrderedDict()
+        self.hits = 0
+        self.lookups = 0
+
+    def __len__(self):
+        return len(self.table)
+
+    #forget every individual and reset the counters, e.g. for a new target
+    def clear(self):
+        self.table.clear()
+        self.hits = 0
+        self.lookups = 0
+
+    def hit_rate(self):
+        return self.hits/max(1,self.lookups)
+
+    #key of each individual of a population [thickness genes, material genes]
+    def keys(self, pop, num_lay, transform):
+        th = np.round(transform(pop[:,:num_lay])/self.quantum).astype(np.int64)
+        mats = pop[:,num_lay:].astype(np.int64)
+        return [key.tobytes() for key in np.concatenate((th,mats),axis=1)]
+
+    #fitness of a population, fcn(pop) gives the fitness of the individuals that are not in the cache
+    def fitness(self, pop, fcn, num_lay, transform):
+        self.lookups += pop.shape[0]
+        if self.size == 0:
+            return fcn(pop)
+        fit = np.empty(pop.shape[0])
+        #individuals to simulate, by key, with every position where they appear in the population
+        new = OrderedDict()
+        for (i,key) in enumerate(self.keys(pop, num_lay, transform)):
+            if key in self.table:
+                fit[i] = self.table[key]
+                self.table.move_to_end(key)
+            else:
+                new.setdefault(key,[]).append(i)
+        self.hits += pop.shape[0]-len(new)
+        if new:
+            first = np.array([idx[0] for idx in new.values()])
+            newfit = fcn(pop[first])
+            for ((key,idx),f) in zip(new.items(),newfit):
+                fit[idx] = f
+                self.table[key] = f
+            while len(self.table) > self.size:
+                self.table.popitem(last=False)
+        return fit
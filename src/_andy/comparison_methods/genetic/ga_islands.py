@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#Island model for the genetic algorithm
+#the populations (islands) of one system evolve at the same time in separate processes, one per core, instead of one
+#after the other as the ensemble of ensemble_fcn. Every migrate generations each island sends its migrants most fit
+#individuals to the next island (ring), where they replace the least fit. The evolution stops early when the best
+#fitness of all islands has improved by less than plateau_tol (relative) over the last patience migrations.
+#the table of materials is put once in shared memory and read by every island without a copy.
+#
+#   (best,bestFit,islandFit,stop) = run_islands(islands,init_fcn,fitness_fcn,breed_fcn,materials,numGen,migrate)
+#       init_fcn()               : initial population of an island
+#       fitness_fcn(pop,table)   : fitness of a population with the table of materials
+#       breed_fcn(pop,fit)       : population of the next generation
+#
+#the islands are forked from the calling process, so they use the fcns (compiled numba operators, caches) as they are
+#there and nothing is pickled. This needs the fork start method (Linux).
+#forking after a parallel kernel (tmm.*_par) has started the TBB or OpenMP thread pool hangs the calling process at
+#exit, so call fork_safe_threading() before any parallel kernel runs, it selects the workqueue threading layer.
+#run_islands refuses to fork when a parallel kernel already runs on another layer.
+
+import multiprocessing as mp
+import numba
+from numba import jit
+import numpy as np
+
+ctx = mp.get_context('fork')
+
+
+#threading layer of the parallel kernels that can be forked, must be set before the first parallel kernel runs
+def fork_safe_threading():
+    numba.config.THREADING_LAYER = 'workqueue'
+
+
+#raises if a parallel kernel has started a thread pool that cannot be forked
+def check_threading():
+    try:
+        layer = numba.threading_layer()
+    except ValueError:
+        #no parallel kernel has run yet, the islands start their own thread pools
+        return
+    if layer != 'workqueue':
+        raise RuntimeError('the %s threading layer was started before the islands are forked, call '
+                           'fork_safe_threading() before any parallel kernel runs'%layer)
+
+
+#numba has its own random generator, it is copied by the fork and must be seeded in every island
+@jit(nopython=True)
+def seed_numba(seed):
+    np.random.seed(seed)
+
+
+#complex table of materials (M,W) in shared memory, returns the shared buffer and its numpy view
+def shared_table(materials):
+    raw = ctx.RawArray('d',2*materials.size)
+    table = np.frombuffer(raw,dtype=np.complex128).reshape(materials.shape)
+    table[:] = materials
+    return (raw,table)
+
+
+#process of one island, evolves its population for the number of generations asked and returns its migrants
+def island(conn, seed, raw, shape, init_fcn, fitness_fcn, breed_fcn, migrants):
+    seed_numba(seed)
+    np.random.seed(seed)
+    table = np.frombuffer(raw,dtype=np.complex128).reshape(shape)
+    pop = init_fcn()
+    fit = fitness_fcn(pop,table)
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        (gens,imm) = msg
+        #immigrants replace the least fit individuals, they come with their fitness
+        if imm is not None:
+            worst = np.argsort(fit)[:imm[0].shape[0]]
+            pop[worst] = imm[0]
+            fit[worst] = imm[1]
+        for gen in range(gens):
+            pop = breed_fcn(pop,fit)
+            fit = fitness_fcn(pop,table)
+        elite = np.argsort(-fit)[:migrants]
+        conn.send((pop[elite].copy(),fit[elite].copy()))
+    conn.close()
+
+
+#evolve islands populations for at most numGen generations with a migration every migrate generations
+#returns the best individual of all islands, its fitness, the best fitness of each island and the generation reached
+def run_islands(islands, init_fcn, fitness_fcn, breed_fcn, materials, numGen, migrate, migrants=2,
+                patience=2, plateau_tol=1E-3, seed=None):
+    if numGen < 1:
+        raise ValueError('numGen must be at least 1, got %d'%numGen)
+    check_threading()
+    if seed is None:
+        seed = np.random.randint(0,2**31-islands)
+    (raw,table) = shared_table(materials)
+    conns = []
+    procs = []
+    for i in range(islands):
+        (a,b) = ctx.Pipe()
+        p = ctx.Process(target=island,args=(b,seed+i,raw,table.shape,init_fcn,fitness_fcn,breed_fcn,migrants))
+        p.daemon = True
+        p.start()
+        conns.append(a)
+        procs.append(p)
+    try:
+        gen = 0
+        imm = [None]*islands
+        best = None
+        bestFit = -np.inf
+        hist = []
+        while gen < numGen:
+            gens = min(migrate,numGen-gen)
+            #ring topology, island i receives the migrants of island i-1
+            for (i,c) in enumerate(conns):
+                c.send((gens,imm[i-1]))
+            imm = [c.recv() for c in conns]
+            gen += gens
+            islandFit = np.array([np.max(f) for (pop,f) in imm])
+            i = np.argmax(islandFit)
+            if islandFit[i] > bestFit:
+                bestFit = islandFit[i]
+                best = imm[i][0][np.argmax(imm[i][1])].copy()
+            hist.append(bestFit)
+            #plateau: relative improvement of the best fitness over the last patience migrations
+            if len(hist) > patience and abs(hist[-1]-hist[-1-patience]) <= plateau_tol*abs(hist[-1-patience]):
+                break
+    finally:
+        for c in conns:
+            try:
+                c.send(None)
+            except OSError:
+                #the island has already ended (error in the island, see its traceback)
+                pass
+        for p in procs:
+            p.join()
+    return (best,bestFit,islandFit,gen)
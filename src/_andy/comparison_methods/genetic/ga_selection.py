@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#Selection operators of the genetic algorithm
+#each operator picks numMating parents from a population with fitness fit (higher is better) and returns them as a
+#new (numMating, numParams) array, the population and the fitness are not modified. The cost grows linearly with the
+#population (rank also sorts it once), so selection stays negligible next to the fitness for populations of 10^4.
+#   argmax     : the numMating most fit, found by repeated argmax, the original matingPool (O(P*numMating))
+#   truncation : the same parents found with one partition of the fitness (O(P)), ordered from the most fit
+#   tournament : each parent is the most fit of tsize individuals drawn at random
+#   rank       : stochastic universal sampling with weights given by the rank of the fitness (worst = 1)
+#   sus        : stochastic universal sampling with weights given by the fitness shifted to the worst individual
+#
+#   parents = select(newPop,fit,numMating,methods['truncation'],2)
+#
+#argmax and truncation give the same parents in the same order (up to individuals of equal fitness)
+
+from numba import jit
+import numpy as np
+
+#numbers of the operators for select
+methods = {'argmax':0,'truncation':1,'tournament':2,'rank':3,'sus':4}
+
+
+@jit(nopython=True)
+def argmax_pool(pop, fit, numMating):
+    fit = fit.copy()
+    parents = np.empty((numMating,pop.shape[1]))
+    for parent in range(numMating):
+        max_fit = np.argmax(fit)
+        parents[parent,:] = pop[max_fit,:]
+        fit[max_fit] = -np.inf
+    return parents
+
+
+#indices of the numMating largest values of fit, from the largest
+#np.partition finds the threshold in linear time (np.argpartition is not available in numba 0.51)
+@jit(nopython=True)
+def top_indices(fit, numMating):
+    neg = -fit
+    kth = np.partition(neg,numMating-1)[numMating-1]
+    idx = np.empty(numMating,dtype=np.int64)
+    k = 0
+    for i in range(fit.size):
+        if neg[i] < kth:
+            idx[k] = i
+            k += 1
+    #individuals equal to the threshold fill the remaining places, the first ones first as with argmax
+    for i in range(fit.size):
+        if k == numMating:
+            break
+        if neg[i] == kth:
+            idx[k] = i
+            k += 1
+    return idx[np.argsort(neg[idx],kind='mergesort')]
+
+
+@jit(nopython=True)
+def truncation(pop, fit, numMating):
+    idx = top_indices(fit, numMating)
+    parents = np.empty((numMating,pop.shape[1]))
+    for k in range(numMating):
+        parents[k,:] = pop[idx[k],:]
+    return parents
+
+
+@jit(nopython=True)
+def tournament(pop, fit, numMating, tsize):
+    parents = np.empty((numMating,pop.shape[1]))
+    for k in range(numMating):
+        best = np.random.randint(0,fit.size)
+        for t in range(tsize-1):
+            i = np.random.randint(0,fit.size)
+            if fit[i] > fit[best]:
+                best = i
+        parents[k,:] = pop[best,:]
+    return parents
+
+
+#stochastic universal sampling: numMating equally spaced pointers with one random offset over the cumulative
+#weights, a single pass over the population
+@jit(nopython=True)
+def sus_indices(weights, numMating):
+    cum = np.cumsum(weights)
+    step = cum[-1]/numMating
+    ptr = np.random.rand()*step
+    idx = np.empty(numMating,dtype=np.int64)
+    i = 0
+    for k in range(numMating):
+        while i < weights.size-1 and cum[i] < ptr:
+            i += 1
+        idx[k] = i
+        ptr += step
+    return idx
+
+
+@jit(nopython=True)
+def sus(pop, fit, numMating):
+    #weights shifted so the worst individual has a small non zero chance, all equal if the fitness is flat
+    span = np.max(fit)-np.min(fit)
+    weights = fit-np.min(fit)+(1E-3*span if span > 0 else 1.)
+    idx = sus_indices(weights, numMating)
+    parents = np.empty((numMating,pop.shape[1]))
+    for k in range(numMating):
+        parents[k,:] = pop[idx[k],:]
+    return parents
+
+
+@jit(nopython=True)
+def rank(pop, fit, numMating):
+    weights = np.empty(fit.size)
+    weights[np.argsort(fit)] = np.arange(1,fit.size+1)
+    idx = sus_indices(weights, numMating)
+    parents = np.empty((numMating,pop.shape[1]))
+    for k in range(numMating):
+        parents[k,:] = pop[idx[k],:]
+    return parents
+
+
+#parents with the operator number method (see methods), tsize is only used by tournament
+@jit(nopython=True)
+def select(pop, fit, numMating, method, tsize):
+    if method == 0:
+        return argmax_pool(pop, fit, numMating)
+    elif method == 1:
+        return truncation(pop, fit, numMating)
+    elif method == 2:
+        return tournament(pop, fit, numMating, tsize)
+    elif method == 3:
+        return rank(pop, fit, numMating)
+    return sus(pop, fit, numMating)
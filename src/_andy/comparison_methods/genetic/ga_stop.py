@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#Convergence detection for the genetic algorithm
+#the evolution of a population is stopped before numGen generations when
+#   plateau   : the best fitness improved by less than tol (relative) over the last window generations
+#   diversity : the population collapsed, the spread of its thicknesses (std over the population relative to the
+#               thickness range, mean over the layers) plus the fraction of individuals not sharing the most common
+#               material combination is below div
+#   target    : the RMSE of the best individual is at most rmse (0 never stops on the RMSE)
+#the generation at which each population stopped and the reason are recorded, so the runtime saved can be reported
+#
+#   convergence = Convergence(window=10,tol=1E-4,div=1E-3,rmse=0.)
+#   reason = convergence.check(hist[:gen+1],newPop,fit,num_lay,transform,trange)   #None to continue
+#   convergence.record(gen+1,reason)
+
+import numpy as np
+
+reasons = ['plateau','diversity','target','numGen']
+
+
+#diversity of a population [thickness genes, material genes], 0 when every individual is the same
+def diversity(pop, num_lay, transform, trange):
+    th = transform(pop[:,:num_lay])
+    spread = np.mean(np.std(th,axis=0))/(trange[1]-trange[0])
+    counts = np.unique(pop[:,num_lay:],axis=0,return_counts=True)[1]
+    return spread+1-np.max(counts)/pop.shape[0]
+
+
+class Convergence:
+    #window = 0 disables the plateau, div = 0 the diversity and rmse = 0 the target criterion
+    def __init__(self, window=10, tol=1E-4, div=1E-3, rmse=0.):
+        self.window = window
+        self.tol = tol
+        self.div = div
+        self.rmse = rmse
+        self.clear()
+
+    #forget the recorded populations, e.g. for a new target
+    def clear(self):
+        self.gens = []
+        self.counts = dict((reason,0) for reason in reasons)
+
+    #reason to stop after the last generation of hist (best fitness of each generation so far), None to continue
+    def check(self, hist, pop, fit, num_lay, transform, trange):
+        if self.rmse > 0 and np.sqrt(-hist[-1]) <= self.rmse:
+            return 'target'
+        if self.window > 0 and hist.size > self.window:
+            old = hist[-1-self.window]
+            if hist[-1]-old <= self.tol*abs(old):
+                return 'plateau'
+        if self.div > 0 and diversity(pop, num_lay, transform, trange) < self.div:
+            return 'diversity'
+        return None
+
+    #the population stopped after gens generations, reason None if it ran all of them
+    def record(self, gens, reason):
+        self.gens.append(gens)
+        self.counts['numGen' if reason is None else reason] += 1
+
+    #mean number of generations of the recorded populations
+    def mean_gens(self):
+        return np.mean(self.gens) if self.gens else np.nan
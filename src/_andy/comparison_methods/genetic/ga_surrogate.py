@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#Surrogate screening of the genetic algorithm populations
+#a forward network (structure --> spectra, CNNs/structure2spectra) predicts the spectra of a whole population in
+#one batched call, the population is ranked on the predicted fitness and only the best fraction (confirm) is
+#simulated with the exact TMM. The other individuals keep their surrogate ranking but are placed below the worst
+#confirmed individual, so selection always prefers exactly evaluated individuals and the returned optimum is an
+#exact fitness.
+#
+#   fit = screened_fit(newPop,exact_fcn,model_file,(rp,rs),('rp','rs'),num_lay,num_mat,transform,confirm)
+#
+#the model is loaded once per process (the joblib workers each load their own copy) the first time it is used
+
+import numpy as np
+
+#outputs of the structure2spectra model, in order, and the rescaling undone on each
+quantities = ['rp','rs','tp','ts','psi','delta']
+scale = {'psi':90.,'delta':90.}
+
+#models already loaded in this process, by filename
+models = {}
+
+#counters of the individuals evaluated with the surrogate and with the exact TMM in this process
+counts = {'surrogate':0,'exact':0}
+
+
+def load_model(filename):
+    if filename not in models:
+        #keras is only imported when a surrogate is used, the exact GA does not need it
+        from keras.models import load_model as keras_load
+        models[filename] = keras_load(filename)
+    return models[filename]
+
+
+#network inputs of a population [thickness genes, material genes]
+#thicknesses are tanh transformed to meters and rescaled as in the training script (resc_th), materials one-hot
+def structure_inputs(pop, num_lay, num_mat, transform):
+    th = transform(pop[:,:num_lay])*1E7
+    mats = pop[:,num_lay:].astype(np.int64)
+    onehot = np.eye(num_mat)
+    return [th]+[onehot[mats[:,j]] for j in range(num_lay)]
+
+
+#predicted spectra (P, num_ang*num_wave) of the population for each quantity in names
+def predict(model_file, pop, names, num_lay, num_mat, transform):
+    model = load_model(model_file)
+    out = model.predict_on_batch(structure_inputs(pop, num_lay, num_mat, transform))
+    counts['surrogate'] += pop.shape[0]
+    return [np.asarray(out[quantities.index(name)],dtype=np.float64)*scale.get(name,1.) for name in names]
+
+
+#-MSE of the predicted spectra against the targets, the same fitness as calcFit
+def surrogate_fit(model_file, pop, targets, names, num_lay, num_mat, transform):
+    pred = predict(model_file, pop, names, num_lay, num_mat, transform)
+    res = np.concatenate([p-t[None,:] for (p,t) in zip(pred,targets)],axis=1)
+    return -1*np.mean(np.square(res),axis=1)
+
+
+#fitness of the population with only the best ceil(confirm*P) individuals on the surrogate simulated exactly
+#exact_fcn(pop) is the exact fitness of a population (the calcFit of the script with its targets)
+#returns (fitness, mask of the exactly evaluated individuals)
+def screened_fit(pop, exact_fcn, model_file, targets, names, num_lay, num_mat, transform, confirm):
+    sfit = surrogate_fit(model_file, pop, targets, names, num_lay, num_mat, transform)
+    order = np.argsort(-sfit)
+    k = min(pop.shape[0],max(1,int(np.ceil(confirm*pop.shape[0]))))
+    top = order[:k]
+    rest = order[k:]
+    fit = np.empty(pop.shape[0])
+    fit[top] = exact_fcn(pop[top])
+    counts['exact'] += k
+    #unconfirmed individuals keep the surrogate order, strictly below every confirmed fitness
+    if rest.size:
+        fit[rest] = np.min(fit[top])-(np.max(sfit[rest])-sfit[rest])-1E-12
+    mask = np.zeros(pop.shape[0],dtype=bool)
+    mask[top] = True
+    return (fit,mask)
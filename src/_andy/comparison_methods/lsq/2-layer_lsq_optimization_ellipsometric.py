@@ -6,6 +6,8 @@ import numpy as np
 import TMM_numba as tmm
 from scipy.optimize import least_squares
 import h5py
+import data_reader as rdr
+import lsq_screen as ls
 import matplotlib.pyplot as plt
 import BB_metals as bb
 import LD_metals as ld
@@ -76,38 +78,18 @@ def resc_delt(in_delt):
 
 #read in data and rescale output data tuple
 def readin_data(filename,nmat,nang,nlay,nwave):
-    f = h5py.File(filename,'r')
-    arrd = np.array(f.get('data'))
-    itl=0
-    ith=nang
-    theta = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nmat
-    ml1 = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nmat
-    ml2 = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nlay
-    th = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    rp = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    rs = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    tp = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    ts = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    psi = (arrd[:,itl:ith])
-    itl=ith
-    delta = (arrd[:,itl:])
-    f.close()    
+    #lazy views of the dataset: rows are read from the file only when they are indexed (see data_reader.py)
+    data = rdr.DataSet(filename,nmat,nang,nlay,nwave)
+    theta = data.column('ang')
+    ml1 = data.mats(0)
+    ml2 = data.mats(1)
+    th = data.column('l')
+    rp = data.column('rp')
+    rs = data.column('rs')
+    tp = data.column('tp')
+    ts = data.column('ts')
+    psi = data.column('psi')
+    delta = data.column('delta')
     return (ml1,ml2,th,theta,rp,rs,tp,ts,psi,delta)
 
 
@@ -142,6 +124,21 @@ def residuals_fcn_pd(x,n,p,d):
 
     return np.concatenate(((psi-p),(delta-d)))
 
+
+#analytic Jacobian of residuals_fcn_pd, passed to least_squares as jac=
+#the derivatives of the layer matrices give d(Psi,Delta)/d(thickness) in the same TMM pass as the spectra,
+#instead of the num_lay+1 finite difference sweeps least_squares would otherwise make
+@jit(nopython=True)
+def jac_fcn_pd(x,n,p,d):
+    xt = transform(x)
+    dxt = 0.5*(trange[1]-trange[0])*(1-np.tanh(x)**2)
+    ang = np.array([25.,45.,65.])
+    (spec,jac) = tmm.spectra_jac(ang, wave, n, xt, np.ones(wave.size), n_subst)
+    #flattened as [spec(ang1),spec(ang2),...] like the residuals, chained through the thickness transform
+    j_psi = jac[4].reshape((ang.size*wave.size,x.size))*dxt
+    j_delta = jac[5].reshape((ang.size*wave.size,x.size))*dxt
+    return np.concatenate((j_psi,j_delta))
+
 #generation function to be called by parallelization module
 #performs the least squares optimization and any necessary globalization (over discrete materials subspaces).
 #optimization is performed with the SCIPY least_squares module
@@ -167,7 +164,7 @@ def gen_fcn_pd(g,fitType,numGlobal):
                 n[0,:] = materials[i]
                 n[1,:] = materials[j]
             	#perform the LM LSQ optimization here
-            	plsq = least_squares(residuals_fcn_pd,x0,args=(n,p,d),method='lm',max_nfev=max_its)
+            	plsq = least_squares(residuals_fcn_pd,x0,args=(n,p,d),jac=jac_fcn_pd,method='lm',max_nfev=max_its)
             	#calculate the MSE for the optimized thickness in this subspace
             	mse = np.mean(residuals_fcn_pd(plsq.x,n,p,d)**2)
             	#if this is the best MSE so far, save the structure and MSE
@@ -189,7 +186,7 @@ def gen_fcn_pd(g,fitType,numGlobal):
                     n[0,:] = materials[i]
                     n[1,:] = materials[j]
                     #perform the LM LSQ optimization here
-                    plsq = least_squares(residuals_fcn_pd,x0,args=(n,p,d),method='lm',max_nfev=max_its)
+                    plsq = least_squares(residuals_fcn_pd,x0,args=(n,p,d),jac=jac_fcn_pd,method='lm',max_nfev=max_its)
                     mse = np.mean(residuals_fcn_pd(plsq.x,n,p,d)**2)
                     #if this is the best MSE so far, save the structure and MSE
                     #only saves the structure if the thicknesses are in the physical parameter range
@@ -200,6 +197,33 @@ def gen_fcn_pd(g,fitType,numGlobal):
     #return the best structure and the spectral RMSE
     return np.concatenate((bx0,np.sqrt(np.array([bmse]))))
 
+#two stage fit: every materials subspace is scored at a few thickness seeds on coarse wavelengths (see lsq_screen.py)
+#and only the topk best subspaces get the full LM fit, started from their best seed (topk = subs.shape[0] fits them all)
+#the seeds only depend on the system, so the screening is the same for every topk
+#returns the best structure, the spectral RMSE and the screening rank of the best subspace
+def gen_fcn_pd_screened(g,topk):
+    p = tp[g,:]
+    d = td[g,:]
+    #first seeds in the tanh space of the fit, the same for every subspace
+    rng = np.random.RandomState(g)
+    xs = rng.normal(0,0.85,size = (screen_seeds,num_lay))
+    (order,x0) = ls.screen(subs,xs,transform,materials,ang,wave,n_subst,np.stack((p,d)),np.array([4,5]),screen_step,screen_rounds,rng)
+    bmse = 1E10
+    bx0 = np.zeros(num_lay*2)
+    brank = 0
+    for (r,s) in enumerate(order[:topk]):
+        #define the structure with the materials of the subspace
+        n = materials[subs[s]]
+        #perform the LM LSQ optimization here
+        plsq = least_squares(residuals_fcn_pd,x0[s],args=(n,p,d),jac=jac_fcn_pd,method='lm',max_nfev=max_its)
+        mse = np.mean(residuals_fcn_pd(plsq.x,n,p,d)**2)
+        #the transformed thicknesses are always in the physical parameter range
+        if mse <= bmse:
+            bmse = mse
+            bx0 = np.concatenate((subs[s].astype(np.float64),transform(plsq.x)))
+            brank = r
+    return np.concatenate((bx0,np.sqrt(np.array([bmse])),np.array([brank])))
+
 #Accuracy for materials and thickness MSE metrics
 #compared to the data generation materials and thicknesses
 def accutest(tm,tt,pm,pt):
@@ -272,3 +296,48 @@ for i in range(len(ftype)):
     np.savetxt(filename+'_results.txt',results,delimiter=',')
 
 
+#two stage fits: screening of the materials subspaces, then the full LM fit of the topk best only (see lsq_screen.py)
+#the first configuration fits every subspace and is the reference for the accuracy and speed of the others
+subs = ls.subspaces(num_lay,num_mat)
+screen_seeds = 32 #thickness seeds per subspace
+screen_step = 10 #every screen_step-th wavelength is used for the scores
+screen_rounds = 8 #successive halving rounds refining the scores of the better subspaces
+topk = [subs.shape[0]]+[k for k in [20,10,3,1] if k < subs.shape[0]]
+tmat = np.transpose(np.array([np.argmax(tm1[start:start+systems,:],axis=1),np.argmax(tm2[start:start+systems,:],axis=1)]))
+
+#to initialize the numba functions
+initialize = gen_fcn_pd_screened(0,1)
+
+for k in topk:
+    #print a nice headder for the log file
+    print('\n\n','-'*10,'Starting, screened top %d of %d subspaces'%(k,subs.shape[0]),'-'*10)
+    sta = datetime.datetime.now()
+    print(sta)
+    results= Parallel(n_jobs=cores)(delayed(gen_fcn_pd_screened)(g,k) for g in tqdm(range(start,start+systems)))
+    end = datetime.datetime.now()
+    print('Runtime:',end-sta)
+    sys_runtime = (end-sta)/systems
+    print('Per System:',sys_runtime)
+    sys_runtime_f = np.array([sys_runtime.seconds+sys_runtime.microseconds*1E-6]).astype('float')
+
+    #[materials, thicknesses, spectral RMSE, screening rank of the best subspace] for each system
+    results = np.array(results)
+    metrics = accutest(tmat,tth[start:start+systems,:],results[:,:num_lay],results[:,num_lay:2*num_lay])
+    rmse = np.mean(results[:,-2])
+    print('Resutls:',metrics)
+    print('RMSE:',rmse)
+    if k == topk[0]:
+        ref = (results,rmse,sys_runtime_f[0])
+        #fraction of the systems whose best subspace is in the top k of the screening, for each k
+        print('In top k:',[np.mean(results[:,-1] < kk) for kk in topk])
+    #accuracy vs speed against fitting every subspace: systems with the same materials, speedup of the per system
+    #runtime and change of the mean spectral RMSE (positive is a loss of accuracy)
+    same = np.mean(np.all(results[:,:num_lay] == ref[0][:,:num_lay],axis=1))
+    print('Same materials:',same)
+    print('Speedup:',ref[2]/sys_runtime_f[0])
+    print('dRMSE:',rmse-ref[1])
+    filename = dr_save + 'lsq_ellips_fitresults_2l5m_screen'+str(k)+'_'+sta.strftime('%y')+sta.strftime('%m')+sta.strftime('%d')+'_'+sta.strftime('%H')+sta.strftime('%M')+sta.strftime('%S')
+    print(filename)
+    #save the metrics, runtime per system, RMSE, same materials fraction, speedup and dRMSE
+    np.savetxt(filename+'.txt',np.concatenate((np.reshape(metrics,(2*num_lay,)),sys_runtime_f,np.array([rmse,same,ref[2]/sys_runtime_f[0],rmse-ref[1]]))),delimiter=',')
+    np.savetxt(filename+'_results.txt',results,delimiter=',')
@@ -6,6 +6,8 @@ import numpy as np
 import TMM_numba as tmm
 from scipy.optimize import least_squares
 import h5py
+import data_reader as rdr
+import lsq_screen as ls
 import matplotlib.pyplot as plt
 import BB_metals as bb
 import LD_metals as ld
@@ -76,38 +78,18 @@ def resc_delt(in_delt):
 
 #read in data and rescale output data tuple
 def readin_data(filename,nmat,nang,nlay,nwave):
-    f = h5py.File(filename,'r')
-    arrd = np.array(f.get('data'))
-    itl=0
-    ith=nang
-    theta = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nmat
-    ml1 = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nmat
-    ml2 = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nlay
-    th = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    rp = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    rs = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    tp = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    ts = (arrd[:,itl:ith])
-    itl=ith
-    ith +=nwave*nang
-    psi = (arrd[:,itl:ith])
-    itl=ith
-    delta = (arrd[:,itl:])
-    f.close()    
+    #lazy views of the dataset: rows are read from the file only when they are indexed (see data_reader.py)
+    data = rdr.DataSet(filename,nmat,nang,nlay,nwave)
+    theta = data.column('ang')
+    ml1 = data.mats(0)
+    ml2 = data.mats(1)
+    th = data.column('l')
+    rp = data.column('rp')
+    rs = data.column('rs')
+    tp = data.column('tp')
+    ts = data.column('ts')
+    psi = data.column('psi')
+    delta = data.column('delta')
     return (ml1,ml2,th,theta,rp,rs,tp,ts,psi,delta)
 
 
@@ -146,6 +128,26 @@ def residuals_fcn_rt(x,n,rp,rs,tp,ts):
 #            n_ts[i+wave.size*j] = tmm.trans_amp(0,ang[j], wave[i], n[:,i], x, n_super, n_subst[i])
     return np.concatenate((np.abs(n_rp-rp),np.abs(n_rs-rs)))#,np.abs(n_tp-tp),np.abs(n_ts-ts)))
 
+
+#analytic Jacobian of residuals_fcn_rt, passed to least_squares as jac=
+#the derivatives of the layer matrices give d(Rp,Rs)/d(thickness) in the same TMM pass as the spectra,
+#instead of the num_lay+1 finite difference sweeps least_squares would otherwise make
+@jit(nopython=True)
+def jac_fcn_rt(x,n,rp,rs,tp,ts):
+    xt = transform(x)
+    dxt = 0.5*(trange[1]-trange[0])*(1-np.tanh(x)**2)
+    ang = np.array([25.,45.,65.])
+    (spec,jac) = tmm.spectra_jac(ang, wave, n, xt, np.full(wave.size,n_super), n_subst)
+    #flattened as [spec(ang1),spec(ang2),...] like the residuals
+    n_rp = spec[0].reshape(ang.size*wave.size)
+    n_rs = spec[1].reshape(ang.size*wave.size)
+    j_rp = jac[0].reshape((ang.size*wave.size,x.size))
+    j_rs = jac[1].reshape((ang.size*wave.size,x.size))
+    #derivative of the absolute residuals, chained through the thickness transform
+    j_rp = np.sign(n_rp-rp).reshape((-1,1))*j_rp*dxt
+    j_rs = np.sign(n_rs-rs).reshape((-1,1))*j_rs*dxt
+    return np.concatenate((j_rp,j_rs))
+
 #generation function to be called by parallelization module
 #performs the least squares optimization and any necessary globalization (over discrete materials subspaces).
 #optimization is performed with the SCIPY least_squares module
@@ -171,7 +173,7 @@ def gen_fcn_rt(g,fitType,numGlobal):
                 n[0,:] = materials[i]
                 n[1,:] = materials[j]
             	#perform the LM LSQ optimization here
-            	plsq = least_squares(residuals_fcn_rt,x0,args=(n,rp,rs,tp,ts),method='lm',max_nfev=max_its)
+            	plsq = least_squares(residuals_fcn_rt,x0,args=(n,rp,rs,tp,ts),jac=jac_fcn_rt,method='lm',max_nfev=max_its)
             	#calculate the MSE for the optimized thickness in this subspace
             	mse = np.mean(residuals_fcn_rt(plsq.x,n,rp,rs,tp,ts)**2)
             	#if this is the best MSE so far, save the structure and MSE
@@ -193,7 +195,7 @@ def gen_fcn_rt(g,fitType,numGlobal):
                     n[0,:] = materials[i]
                     n[1,:] = materials[j]
                     #perform the LM LSQ optimization here
-                    plsq = least_squares(residuals_fcn_rt,x0,args=(n,rp,rs,tp,ts),method='lm',max_nfev=max_its)
+                    plsq = least_squares(residuals_fcn_rt,x0,args=(n,rp,rs,tp,ts),jac=jac_fcn_rt,method='lm',max_nfev=max_its)
                     mse = np.mean(residuals_fcn_rt(plsq.x,n,rp,rs,tp,ts)**2)
                     #if this is the best MSE so far, save the structure and MSE
                     #only saves the structure if the thicknesses are in the physical parameter range
@@ -204,6 +206,35 @@ def gen_fcn_rt(g,fitType,numGlobal):
     #return the best structure and the spectral RMSE
     return np.concatenate((bx0,np.sqrt(np.array([bmse]))))
 
+#two stage fit: every materials subspace is scored at a few thickness seeds on coarse wavelengths (see lsq_screen.py)
+#and only the topk best subspaces get the full LM fit, started from their best seed (topk = subs.shape[0] fits them all)
+#the seeds only depend on the system, so the screening is the same for every topk
+#returns the best structure, the spectral RMSE and the screening rank of the best subspace
+def gen_fcn_rt_screened(g,topk):
+    rp = trp[g,:]
+    rs = trs[g,:]
+    tp = ttp[g,:]
+    ts = tts[g,:]
+    #first seeds in the tanh space of the fit, the same for every subspace
+    rng = np.random.RandomState(g)
+    xs = rng.normal(0,0.85,size = (screen_seeds,num_lay))
+    (order,x0) = ls.screen(subs,xs,transform,materials,ang,wave,n_subst,np.stack((rp,rs)),np.array([0,1]),screen_step,screen_rounds,rng)
+    bmse = 1E10
+    bx0 = np.zeros(num_lay*2)
+    brank = 0
+    for (r,s) in enumerate(order[:topk]):
+        #define the structure with the materials of the subspace
+        n = materials[subs[s]]
+        #perform the LM LSQ optimization here
+        plsq = least_squares(residuals_fcn_rt,x0[s],args=(n,rp,rs,tp,ts),jac=jac_fcn_rt,method='lm',max_nfev=max_its)
+        mse = np.mean(residuals_fcn_rt(plsq.x,n,rp,rs,tp,ts)**2)
+        #the transformed thicknesses are always in the physical parameter range
+        if mse <= bmse:
+            bmse = mse
+            bx0 = np.concatenate((subs[s].astype(np.float64),transform(plsq.x)))
+            brank = r
+    return np.concatenate((bx0,np.sqrt(np.array([bmse])),np.array([brank])))
+
 #Accuracy for materials and thickness MSE metrics
 #compared to the data generation materials and thicknesses
 def accutest(tm,tt,pm,pt):
@@ -276,3 +307,48 @@ for i in range(len(ftype)):
     np.savetxt(filename+'_results.txt',results,delimiter=',')
 
 
+#two stage fits: screening of the materials subspaces, then the full LM fit of the topk best only (see lsq_screen.py)
+#the first configuration fits every subspace and is the reference for the accuracy and speed of the others
+subs = ls.subspaces(num_lay,num_mat)
+screen_seeds = 32 #thickness seeds per subspace
+screen_step = 10 #every screen_step-th wavelength is used for the scores
+screen_rounds = 8 #successive halving rounds refining the scores of the better subspaces
+topk = [subs.shape[0]]+[k for k in [20,10,3,1] if k < subs.shape[0]]
+tmat = np.transpose(np.array([np.argmax(tm1[start:start+systems,:],axis=1),np.argmax(tm2[start:start+systems,:],axis=1)]))
+
+#to initialize the numba functions
+initialize = gen_fcn_rt_screened(0,1)
+
+for k in topk:
+    #print a nice headder for the log file
+    print('\n\n','-'*10,'Starting, screened top %d of %d subspaces'%(k,subs.shape[0]),'-'*10)
+    sta = datetime.datetime.now()
+    print(sta)
+    results= Parallel(n_jobs=cores)(delayed(gen_fcn_rt_screened)(g,k) for g in tqdm(range(start,start+systems)))
+    end = datetime.datetime.now()
+    print('Runtime:',end-sta)
+    sys_runtime = (end-sta)/systems
+    print('Per System:',sys_runtime)
+    sys_runtime_f = np.array([sys_runtime.seconds+sys_runtime.microseconds*1E-6]).astype('float')
+
+    #[materials, thicknesses, spectral RMSE, screening rank of the best subspace] for each system
+    results = np.array(results)
+    metrics = accutest(tmat,tth[start:start+systems,:],results[:,:num_lay],results[:,num_lay:2*num_lay])
+    rmse = np.mean(results[:,-2])
+    print('Resutls:',metrics)
+    print('RMSE:',rmse)
+    if k == topk[0]:
+        ref = (results,rmse,sys_runtime_f[0])
+        #fraction of the systems whose best subspace is in the top k of the screening, for each k
+        print('In top k:',[np.mean(results[:,-1] < kk) for kk in topk])
+    #accuracy vs speed against fitting every subspace: systems with the same materials, speedup of the per system
+    #runtime and change of the mean spectral RMSE (positive is a loss of accuracy)
+    same = np.mean(np.all(results[:,:num_lay] == ref[0][:,:num_lay],axis=1))
+    print('Same materials:',same)
+    print('Speedup:',ref[2]/sys_runtime_f[0])
+    print('dRMSE:',rmse-ref[1])
+    filename = dr_save + 'lsq_rprstpts_fitresults_2l5m_screen'+str(k)+'_'+sta.strftime('%y')+sta.strftime('%m')+sta.strftime('%d')+'_'+sta.strftime('%H')+sta.strftime('%M')+sta.strftime('%S')
+    print(filename)
+    #save the metrics, runtime per system, RMSE, same materials fraction, speedup and dRMSE
+    np.savetxt(filename+'.txt',np.concatenate((np.reshape(metrics,(2*num_lay,)),sys_runtime_f,np.array([rmse,same,ref[2]/sys_runtime_f[0],rmse-ref[1]]))),delimiter=',')
+    np.savetxt(filename+'_results.txt',results,delimiter=',')
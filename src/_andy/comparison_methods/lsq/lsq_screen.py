@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#Screening of the materials subspaces for the least squares fits
+#a full LM fit in every ordered materials subspace (num_mat*(num_mat-1)**(num_lay-1) of them) is the cost of the lsq
+#scripts. Every subspace is first scored with the batched TMM on every step-th wavelength at a few thickness seeds
+#(one call for all of them), then only the best subspaces get the full fit, each started from its best seed.
+#the scores are refined by successive halving: in each of rounds rounds the better half of the subspaces gets new
+#seeds around its best seed (in the tanh space of the fit, sigma halved every round) and is scored again.
+#
+#   subs = subspaces(num_lay,num_mat)
+#   (order,x0) = screen(subs,xs,transform,materials,ang,wave,n_subst,np.stack((p,d)),np.array([4,5]),step,rounds,rng)
+#       order[:topk] are the subspaces to fit, x0[s] the initial guess of subspace s
+
+import itertools
+import numpy as np
+import TMM_numba as tmm
+
+
+#ordered materials subspaces searched by the lsq scripts, neighbouring layers are different materials
+#same order as the nested loops over the materials, returns (A,num_lay) material numbers
+def subspaces(num_lay, num_mat):
+    subs = [s for s in itertools.product(range(num_mat),repeat=num_lay) if all(a != b for (a,b) in zip(s[:-1],s[1:]))]
+    return np.array(subs,dtype=np.int64)
+
+
+#coarse MSE (A,S) of every subspace subs (A,L) at its thickness seeds th (A,S,L) in meters
+#targets (Q,A*W) spectra flattened as the residuals [spec(ang1),spec(ang2),...], which their numbers in the TMM
+#output (rp,rs,tp,ts,psi,delta), step keeps every step-th wavelength
+def scores(subs, th, materials, ang, wave, n_subst, targets, which, step):
+    idx = np.arange(0,wave.size,step)
+    (A,S,L) = th.shape
+    n = tmm.gather_index(np.ascontiguousarray(materials[:,idx]),np.repeat(subs,S,axis=0).astype(np.float64))
+    t = np.ascontiguousarray(targets.reshape((targets.shape[0],ang.size,wave.size))[:,:,idx].reshape((targets.shape[0],-1)))
+    mse = tmm.mse_batch(ang,wave[idx],n,th.reshape((A*S,L)),np.ones(idx.size,dtype=np.complex128),np.ascontiguousarray(n_subst[idx]),which,t)
+    return mse.reshape((A,S))
+
+
+#subspaces ordered from the best score and the best seed x0 (A,L) of each, in the tanh space of the fit
+#xs (S,L) are the first seeds of every subspace, transform maps them to thicknesses, rng draws the new seeds
+def screen(subs, xs, transform, materials, ang, wave, n_subst, targets, which, step, rounds=0, rng=np.random,
+           sigma=0.5):
+    (A,S,L) = (subs.shape[0],xs.shape[0],xs.shape[1])
+    x = np.broadcast_to(xs,(A,S,L))
+    score = scores(subs, transform(x.reshape((A*S,L))).reshape((A,S,L)), materials, ang, wave, n_subst, targets, which, step)
+    best = np.min(score,axis=1)
+    x0 = x[np.arange(A),np.argmin(score,axis=1)].copy()
+    alive = np.argsort(best,kind='mergesort')
+    dropped = []
+    for r in range(rounds):
+        if alive.size == 1:
+            break
+        #the worse half keeps its place behind the subspaces that go on
+        keep = int(np.ceil(alive.size/2))
+        dropped.insert(0,alive[keep:])
+        alive = alive[:keep]
+        x = x0[alive][:,None,:]+sigma*0.5**r*rng.normal(size=(keep,S,L))
+        score = scores(subs[alive], transform(x.reshape((keep*S,L))).reshape((keep,S,L)), materials, ang, wave, n_subst, targets, which, step)
+        i = np.argmin(score,axis=1)
+        #a subspace keeps its best seed so far
+        better = score[np.arange(keep),i] < best[alive]
+        x0[alive[better]] = x[np.arange(keep),i][better]
+        best[alive[better]] = score[np.arange(keep),i][better]
+        alive = alive[np.argsort(best[alive],kind='mergesort')]
+    return (np.concatenate([alive]+dropped),x0)
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+#Depth-first evaluation of the RMSE space of few-layer stacks
+#every (material, thickness) choice of every layer is a node of a tree whose leaves are the structures
+#the characteristic matrix of each (material, thickness) is computed once, and the partial product of the
+#first q layers is kept per tree level, so moving to the next leaf only redoes the levels that changed.
+#with the thickness of the last layer varying fastest this is ~T/(T-1) 2x2 products per leaf and polarization
+#instead of one per layer, and no trigonometric functions are evaluated at the leaves
+
+import numba
+from numba import jit, prange
+import numpy as np
+import TMM_numba as tmm
+
+
+#all material sequences of num_lay layers in which no two adjacent layers are the same material
+#in the order of the nested material loops of the generate scripts, as a (C,num_lay) int array
+#prefix fixes the materials of the first layers, e.g. prefix = (a,b)
+def material_combos(num_mat, num_lay, prefix=()):
+    combos = [tuple(prefix)]
+    for q in range(len(prefix),num_lay):
+        combos = [c+(m,) for c in combos for m in range(num_mat) if len(c) == 0 or c[-1] != m]
+    return np.array(combos,dtype=np.int64).reshape(-1,num_lay)
+
+
+#characteristic matrix of every material at every thickness, polarization, angle and wavelength
+#   ang, wave, n_cover, n_subst as in the batched TMM kernels
+#   materials : (M,W) complex index of each material, thicks : (T,) thicknesses [m]
+#returns (gammac, gammas, tfac, table)
+#   gammac/gammas/tfac : (2,A,W), table : (M,T,2,A,W,4) layer matrices stored as [m00,m01,m10,m11]
+@jit(nopython=True)
+def layer_table(ang, wave, materials, thicks, n_cover, n_subst):
+    z0 = 376.730313667
+    gammac = np.zeros((2,ang.size,wave.size),dtype=np.complex128)
+    gammas = np.zeros((2,ang.size,wave.size),dtype=np.complex128)
+    tfac = np.zeros((2,ang.size,wave.size))
+    table = np.zeros((materials.shape[0],thicks.size,2,ang.size,wave.size,4),dtype=np.complex128)
+    for j in range(ang.size):
+        for i in range(wave.size):
+            k = 2*np.pi/wave[i]
+            beta = n_cover[i]*np.sin(ang[j]*np.pi/180)
+            cosc = np.cos(ang[j]*np.pi/180)
+            coss = np.sqrt(1-(beta/n_subst[i])**2+0j)
+            gammac[0,j,i] = n_cover[i]*cosc/z0
+            gammas[0,j,i] = n_subst[i]*coss/z0
+            gammac[1,j,i] = z0*cosc/n_cover[i]
+            gammas[1,j,i] = z0*coss/n_subst[i]
+            for rho in range(2):
+                tfac[rho,j,i] = np.real(gammas[rho,j,i])/np.real(gammac[rho,j,i])
+                for m in range(materials.shape[0]):
+                    for p in range(thicks.size):
+                        (table[m,p,rho,j,i,0],table[m,p,rho,j,i,1],table[m,p,rho,j,i,2],table[m,p,rho,j,i,3]) = tmm.layer_matrix(rho, beta, k, materials[m,i], thicks[p])
+    return (gammac,gammas,tfac,table)
+
+
+#partial product of level q+1 = partial product of level q times the layer matrix of material m at thickness index p
+@jit(nopython=True)
+def extend_level(pre, q, table, m, p):
+    for rho in range(pre.shape[1]):
+        for j in range(pre.shape[2]):
+            for i in range(pre.shape[3]):
+                a = pre[q,rho,j,i]
+                b = table[m,p,rho,j,i]
+                (pre[q+1,rho,j,i,0],pre[q+1,rho,j,i,1],pre[q+1,rho,j,i,2],pre[q+1,rho,j,i,3]) = tmm.mat_mul(a[0],a[1],a[2],a[3],b[0],b[1],b[2],b[3])
+
+
+#RMSE of the full stack held at the last level against the target spectra
+#returns (rrp, rrs, rtp, rts, rmse), rmse is the mean of the four
+@jit(nopython=True)
+def leaf_rmse(pre, gammac, gammas, tfac, target):
+    num_lay = pre.shape[0]-1
+    err = np.zeros(4)
+    for j in range(pre.shape[2]):
+        for i in range(pre.shape[3]):
+            m = pre[num_lay,0,j,i]
+            (r0,t0) = tmm.fresnel(gammac[0,j,i],gammas[0,j,i],m[0],m[1],m[2],m[3])
+            m = pre[num_lay,1,j,i]
+            (r1,t1) = tmm.fresnel(gammac[1,j,i],gammas[1,j,i],m[0],m[1],m[2],m[3])
+            err[0] += (target[0,j,i]-(np.real(r1)**2+np.imag(r1)**2))**2
+            err[1] += (target[1,j,i]-(np.real(r0)**2+np.imag(r0)**2))**2
+            err[2] += (target[2,j,i]-tfac[1,j,i]*(np.real(t1)**2+np.imag(t1)**2))**2
+            err[3] += (target[3,j,i]-tfac[0,j,i]*(np.real(t0)**2+np.imag(t0)**2))**2
+    err = np.sqrt(err/(pre.shape[2]*pre.shape[3]))
+    return (err[0],err[1],err[2],err[3],np.mean(err))
+
+
+#RMSE of every structure built from the material sequences in combos and every thickness tuple of the grid
+#   combos : (C,L) material index of each layer, thickness grid : T values per layer (T**L tuples)
+#   gammac, gammas, tfac, table from layer_table
+#   target : (4,A,W) target [rp,rs,tp,ts] spectra
+#returns (C,T**L,5) [rrp,rrs,rtp,rts,rmse], thickness tuples in the order of the nested thickness loops
+#of the generate scripts (last layer fastest). Each material sequence is an independent subtree, so the
+#*_par version splits them over threads
+@jit(nopython=True)
+def rmse_tree(combos, gammac, gammas, tfac, table, target):
+    num_lay = combos.shape[1]
+    numthick = table.shape[1]
+    out = np.zeros((combos.shape[0],numthick**num_lay,5))
+    for c in prange(combos.shape[0]):
+        #partial products of each level, level 0 is the identity
+        pre = np.zeros((num_lay+1,2,gammac.shape[1],gammac.shape[2],4),dtype=np.complex128)
+        pre[0,:,:,:,0] = 1.
+        pre[0,:,:,:,3] = 1.
+        idx = np.zeros(num_lay,dtype=np.int64)
+        #lowest level whose partial product is out of date
+        q0 = 0
+        for it in range(numthick**num_lay):
+            for q in range(q0,num_lay):
+                extend_level(pre, q, table, combos[c,q], idx[q])
+            (out[c,it,0],out[c,it,1],out[c,it,2],out[c,it,3],out[c,it,4]) = leaf_rmse(pre, gammac, gammas, tfac, target)
+            #next thickness tuple, the levels above the last one carried into are kept
+            q0 = num_lay-1
+            idx[q0] += 1
+            while idx[q0] == numthick and q0 > 0:
+                idx[q0] = 0
+                q0 -= 1
+                idx[q0] += 1
+    return out
+
+
+rmse_tree_par = jit(nopython=True, parallel=True)(rmse_tree.py_func)
+
+
+#RMSE space for the material sequences in combos over the thickness grid thicks [m]
+#   target spectra rpt, rst, tpt, tst in the (wave,ang) layout of the spectra text files
+#returns (C,T**L,5) [rrp,rrs,rtp,rts,rmse], see rmse_tree
+def rmse_space(combos, thicks, ang, wave, materials, n_cover, n_subst, rpt, rst, tpt, tst, parallel=False):
+    (gammac,gammas,tfac,table) = layer_table(ang, wave, materials, thicks, n_cover, n_subst)
+    target = np.ascontiguousarray(np.transpose(np.array([rpt,rst,tpt,tst]),(0,2,1)))
+    if parallel:
+        return rmse_tree_par(combos, gammac, gammas, tfac, table, target)
+    return rmse_tree(combos, gammac, gammas, tfac, table, target)
+
+
+#order in which the (angle, wavelength) points of a structure are evaluated by the search, as a (A*W,2) [j,i] array
+#every stride-th wavelength at every angle first, then the points in between, so the first points are a coarse
+#sampling of the whole spectrum
+def coarse_order(num_ang, num_wave, stride):
+    waves = np.concatenate([np.arange(s,num_wave,stride) for s in range(stride)])
+    return np.array([[j,i] for i in waves for j in range(num_ang)],dtype=np.int64)
+
+
+#insert a structure into the sorted top-k list if it is better than the worst entry
+@jit(nopython=True)
+def insert_top(top, top_it, rmse, it):
+    k = top.shape[0]
+    if rmse[4] >= top[k-1,4]:
+        return
+    p = k-1
+    while p > 0 and top[p-1,4] > rmse[4]:
+        top[p] = top[p-1]
+        top_it[p] = top_it[p-1]
+        p -= 1
+    top[p] = rmse
+    top_it[p] = it
+
+
+#branch and bound version of rmse_tree that only keeps the k best structures
+#a structure is evaluated point by point in the order given by coarse_order. The squared residuals summed over
+#part of the points can only grow with more points, so mean(sqrt(partial sums/(A*W))) is a lower bound on its
+#RMSE, and the structure is dropped as soon as that bound reaches the k-th best RMSE found so far (or incumbent).
+#the last layer product is only formed at the points that are evaluated
+#   combos, gammac, gammas, tfac, table, target as in rmse_tree, order from coarse_order
+#   block : number of points between bound checks, incumbent : k-th best RMSE known before this call (np.inf if none)
+#returns (top, top_it, count)
+#   top : (C,k,5) best [rrp,rrs,rtp,rts,rmse] of each sequence, top_it : (C,k) thickness tuple of each entry (-1 if empty)
+#   count : (C,2) [structures evaluated to the end, points evaluated]
+@jit(nopython=True)
+def rmse_bound(combos, gammac, gammas, tfac, table, target, order, block, k, incumbent):
+    num_lay = combos.shape[1]
+    numthick = table.shape[1]
+    npts = order.shape[0]
+    top = np.full((combos.shape[0],k,5),np.inf)
+    top_it = np.full((combos.shape[0],k),-1,dtype=np.int64)
+    count = np.zeros((combos.shape[0],2),dtype=np.int64)
+    for c in prange(combos.shape[0]):
+        pre = np.zeros((num_lay,2,gammac.shape[1],gammac.shape[2],4),dtype=np.complex128)
+        pre[0,:,:,:,0] = 1.
+        pre[0,:,:,:,3] = 1.
+        idx = np.zeros(num_lay,dtype=np.int64)
+        rmse = np.zeros(5)
+        err = np.zeros(4)
+        q0 = 0
+        for it in range(numthick**num_lay):
+            #partial products up to the layer before the last
+            for q in range(q0,num_lay-1):
+                extend_level(pre, q, table, combos[c,q], idx[q])
+            bound = min(incumbent,top[c,k-1,4])
+            m = combos[c,num_lay-1]
+            p = idx[num_lay-1]
+            err[:] = 0.
+            for b0 in range(0,npts,block):
+                for pt in range(b0,min(b0+block,npts)):
+                    j = order[pt,0]
+                    i = order[pt,1]
+                    a = pre[num_lay-1,0,j,i]
+                    b = table[m,p,0,j,i]
+                    (m00,m01,m10,m11) = tmm.mat_mul(a[0],a[1],a[2],a[3],b[0],b[1],b[2],b[3])
+                    (r0,t0) = tmm.fresnel(gammac[0,j,i],gammas[0,j,i],m00,m01,m10,m11)
+                    a = pre[num_lay-1,1,j,i]
+                    b = table[m,p,1,j,i]
+                    (m00,m01,m10,m11) = tmm.mat_mul(a[0],a[1],a[2],a[3],b[0],b[1],b[2],b[3])
+                    (r1,t1) = tmm.fresnel(gammac[1,j,i],gammas[1,j,i],m00,m01,m10,m11)
+                    err[0] += (target[0,j,i]-(np.real(r1)**2+np.imag(r1)**2))**2
+                    err[1] += (target[1,j,i]-(np.real(r0)**2+np.imag(r0)**2))**2
+                    err[2] += (target[2,j,i]-tfac[1,j,i]*(np.real(t1)**2+np.imag(t1)**2))**2
+                    err[3] += (target[3,j,i]-tfac[0,j,i]*(np.real(t0)**2+np.imag(t0)**2))**2
+                count[c,1] += min(b0+block,npts)-b0
+                for e in range(4):
+                    rmse[e] = np.sqrt(err[e]/npts)
+                rmse[4] = np.mean(rmse[:4])
+                if rmse[4] >= bound:
+                    break
+            if rmse[4] < bound:
+                count[c,0] += 1
+                insert_top(top[c], top_it[c], rmse, it)
+            q0 = num_lay-1
+            idx[q0] += 1
+            while idx[q0] == numthick and q0 > 0:
+                idx[q0] = 0
+                q0 -= 1
+                idx[q0] += 1
+    return (top,top_it,count)
+
+
+rmse_bound_par = jit(nopython=True, parallel=True)(rmse_bound.py_func)
+
+
+#k best structures of the sequences in combos with the layer matrices in table, the sequences are searched chunk
+#at a time with kernel and the k-th best is shared between the chunks, see rmse_search
+#returns (best, best_it, best_combo, count), count : [structures evaluated to the end, points evaluated]
+def search_chunks(kernel, chunk, combos, gammac, gammas, tfac, table, target, order, block, k, incumbent):
+    num_lay = combos.shape[1]
+    best = np.full((k,5),np.inf)
+    best_combo = np.zeros((k,num_lay),dtype=np.int64)
+    best_it = np.full(k,-1,dtype=np.int64)
+    count = np.zeros(2,dtype=np.int64)
+    for c0 in range(0,combos.shape[0],chunk):
+        (top,top_it,cnt) = kernel(combos[c0:c0+chunk], gammac, gammas, tfac, table, target, order, block, k, min(incumbent,best[k-1,4]))
+        count += cnt.sum(axis=0)
+        #merge the best of each sequence with the best so far
+        vals = np.concatenate([best,top.reshape(-1,5)])
+        its = np.concatenate([best_it,top_it.reshape(-1)])
+        cmb = np.concatenate([best_combo,np.repeat(combos[c0:c0+chunk],k,axis=0)])
+        keep = np.argsort(vals[:,4],kind='stable')[:k]
+        (best,best_it,best_combo) = (vals[keep],its[keep],cmb[keep])
+    return (best,best_it,best_combo,count)
+
+
+#exact k best structures of the RMSE space, skipping every structure that cannot beat the current k-th best
+#   combos, thicks, ang, wave, materials, n_cover, n_subst, target spectra as in rmse_space
+#   stride : wavelength stride of the coarse first pass, block : points between bound checks (default one coarse pass)
+#   seed_stride : the search first runs on every seed_stride-th thickness of the grid. The k-th best RMSE of these
+#                 structures bounds the k-th best of the whole grid from above, so the full search prunes from its
+#                 first structure instead of after its first k (1 skips this pass)
+#the sequences are searched num_threads at a time when parallel, the k-th best is shared between groups of sequences
+#the partial RMSE is only a lower bound once most points are in, so how much is pruned depends on how far most
+#structures are from the k best: targets that some structure fits well prune far more than random spectra
+#returns (best_combos, best_thicks, best_rmse, report)
+#   best_combos : (k,L) materials, best_thicks : (k,L) thicknesses [m], best_rmse : (k,5) [rrp,rrs,rtp,rts,rmse]
+#   report : dict with the number of structures, how many were evaluated to the end (both passes), the fraction
+#            of the (structure, point) TMM evaluations done (both passes) and the fraction avoided
+def rmse_search(combos, thicks, ang, wave, materials, n_cover, n_subst, rpt, rst, tpt, tst, k=10, stride=8, block=None,
+                seed_stride=4, parallel=False):
+    (gammac,gammas,tfac,table) = layer_table(ang, wave, materials, thicks, n_cover, n_subst)
+    target = np.ascontiguousarray(np.transpose(np.array([rpt,rst,tpt,tst]),(0,2,1)))
+    order = coarse_order(ang.size, wave.size, stride)
+    if block is None:
+        block = ang.size*((wave.size+stride-1)//stride)
+    chunk = numba.get_num_threads() if parallel else 1
+    kernel = rmse_bound_par if parallel else rmse_bound
+    num_lay = combos.shape[1]
+    count = np.zeros(2,dtype=np.int64)
+    incumbent = np.inf
+    if seed_stride > 1:
+        sub = np.ascontiguousarray(table[:,::seed_stride])
+        (seed,seed_it,seed_combo,count) = search_chunks(kernel, chunk, combos, gammac, gammas, tfac, sub, target, order, block, k, np.inf)
+        #these structures are on the grid too, the next float keeps the k-th of them in the full search
+        incumbent = np.nextafter(seed[k-1,4],np.inf)
+    (best,best_it,best_combo,cnt) = search_chunks(kernel, chunk, combos, gammac, gammas, tfac, table, target, order, block, k, incumbent)
+    count += cnt
+    found = best_it >= 0
+    thick_idx = np.array(np.unravel_index(best_it[found],(thicks.size,)*num_lay)).T
+    leaves = combos.shape[0]*thicks.size**num_lay
+    work = count[1]/(leaves*order.shape[0])
+    report = {'structures': leaves,
+              'evaluated': int(count[0]),
+              'work_fraction': float(work),
+              'pruned_fraction': float(1-work)}
+    return (best_combo[found],thicks[thick_idx],best[found],report)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#Sharded and resumable generation of the RMSE space
+#the material sequences are the work units: shard s of S takes every S-th sequence of material_combos,
+#so any number of nodes can split the space without editing the scripts. Each finished sequence is written
+#to the HDF5 file of the shard (see mse_store) and then appended to the manifest of the shard, a rerun of the
+#same shard skips everything in the manifest and redoes only the sequences that were interrupted
+
+import os
+import numpy as np
+import numba
+import mse_grid as mg
+import mse_store as ms
+
+
+#material sequences handled by shard `shard` of `num_shards`
+def shard_combos(num_mat, num_lay, shard, num_shards):
+    if shard < 0 or shard >= num_shards:
+        raise ValueError('shard must be in [0, num_shards), got %d of %d'%(shard,num_shards))
+    return mg.material_combos(num_mat, num_lay)[shard::num_shards]
+
+
+#file identifier of a material sequence and the finished sequences of a manifest, see mse_store
+combo_name = ms.combo_name
+read_manifest = ms.read_manifest
+
+
+#the thickness grid is stored with the results, a shard resumed with a different grid would mix two spaces
+#shards started at the same time race to store it: each writes its own temporary file and links it to thicks.txt,
+#which only succeeds if thicks.txt does not exist, so the file is never partly written and the first grid is kept
+def check_grid(dr_save, thicks):
+    filename = os.path.join(dr_save,'thicks.txt')
+    if not os.path.exists(filename):
+        tmp = '%s.%d.tmp'%(filename,os.getpid())
+        np.savetxt(tmp,thicks)
+        try:
+            os.link(tmp,filename)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+    saved = np.atleast_1d(np.loadtxt(filename))
+    if saved.shape != thicks.shape or not np.allclose(saved,thicks):
+        raise ValueError('%s holds results for a different thickness grid'%dr_save)
+
+
+#generate the RMSE of every material sequence of this shard at every thickness tuple of the grid thicks [m]
+#results go to <dr_save>/rmse_<shard>of<num_shards>.h5, read them back with mse_store.load_rmse
+#the sequences are evaluated num_threads at a time (all cores by default) with the multi-threaded engine
+#returns the number of sequences computed in this call
+def run_shard(dr_save, num_mat, num_lay, thicks, ang, wave, materials, n_cover, n_subst, rpt, rst, tpt, tst,
+              shard=0, num_shards=1, num_threads=None):
+    os.makedirs(dr_save,exist_ok=True)
+    check_grid(dr_save, thicks)
+    if num_threads is not None:
+        numba.set_num_threads(num_threads)
+    manifest = ms.manifest_name(dr_save, shard, num_shards)
+    done = read_manifest(manifest)
+    combos = shard_combos(num_mat, num_lay, shard, num_shards)
+    #position in the shard of every sequence still to compute
+    todo = np.array([c for c in range(combos.shape[0]) if combo_name(combos[c]) not in done],dtype=np.int64)
+    print('Shard %d of %d: %d sequences, %d already done.\n'%(shard,num_shards,combos.shape[0],combos.shape[0]-todo.size))
+    (gammac,gammas,tfac,table) = mg.layer_table(ang, wave, materials, thicks, n_cover, n_subst)
+    target = np.ascontiguousarray(np.transpose(np.array([rpt,rst,tpt,tst]),(0,2,1)))
+    chunk = numba.get_num_threads()
+    with ms.open_store(dr_save, combos, thicks, shard, num_shards) as f:
+        for c0 in range(0,todo.size,chunk):
+            rmse = mg.rmse_tree_par(combos[todo[c0:c0+chunk]], gammac, gammas, tfac, table, target)
+            for c in range(rmse.shape[0]):
+                ms.write_sequence(f, todo[c0+c], rmse[c])
+                #the sequence only counts as done once its rows are on disk
+                with open(manifest,'a') as m:
+                    m.write(combo_name(combos[todo[c0+c]])+'\n')
+            print('%d of %d sequences done.'%(min(c0+chunk,todo.size),todo.size))
+    return todo.size
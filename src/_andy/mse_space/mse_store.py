@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#HDF5 storage of the RMSE space
+#each shard writes one file <dr_save>/rmse_<s>of<S>.h5 holding
+#   combos : (C,L) material sequences of the shard, in the order of mse_runner.shard_combos
+#   thicks : (T,) thickness grid [m]
+#   rmse   : (C,T**L,5) [rrp,rrs,rtp,rts,rmse] of every sequence at every thickness tuple (last layer fastest)
+#rmse is chunked by material sequence and gzip compressed, so reading one sequence only decompresses its own rows
+#rows of sequences not written yet are NaN, a sequence is only finished once it is in the manifest of its shard
+#<dr_save>/manifest_<s>of<S>.txt (one combo_name per line)
+
+import os
+import re
+import glob
+import h5py
+import numpy as np
+
+columns = ['rrp','rrs','rtp','rts','rmse']
+#largest number of thickness tuples in one chunk
+chunk_rows = 65536
+
+
+#file of a shard in the output folder
+def store_name(dr_save, shard, num_shards):
+    return os.path.join(dr_save,'rmse_%dof%d.h5'%(shard,num_shards))
+
+
+#manifest of a shard in the output folder
+def manifest_name(dr_save, shard, num_shards):
+    return os.path.join(dr_save,'manifest_%dof%d.txt'%(shard,num_shards))
+
+
+#file identifier of a material sequence, e.g. (0,1,2) -> '0_1_2'
+def combo_name(combo):
+    return '_'.join(str(m) for m in combo)
+
+
+#names of the material sequences already finished by a shard, empty if it has not started
+def read_manifest(filename):
+    if not os.path.exists(filename):
+        return set()
+    with open(filename) as f:
+        return set(line.strip() for line in f if line.strip())
+
+
+#open the file of a shard for writing, it is created with room for all of its sequences the first time
+#returns the open h5py.File, rows are written with write_sequence
+def open_store(dr_save, combos, thicks, shard, num_shards):
+    f = h5py.File(store_name(dr_save, shard, num_shards),'a')
+    if 'rmse' not in f:
+        numrows = thicks.size**combos.shape[1]
+        f.create_dataset('combos',data=combos.astype(np.int8))
+        f.create_dataset('thicks',data=thicks)
+        f.create_dataset('rmse',shape=(combos.shape[0],numrows,len(columns)),dtype=np.float32,
+                         chunks=(1,min(numrows,chunk_rows),len(columns)),compression='gzip',shuffle=True,
+                         fillvalue=np.nan)
+        f.attrs['columns'] = ','.join(columns)
+    return f
+
+
+#write the (T**L,5) RMSE of sequence c of the shard, flushed to disk before returning
+def write_sequence(f, c, rmse):
+    f['rmse'][c] = rmse
+    f.flush()
+
+
+#thickness index of each layer for row `it` of a sequence, as a (L,) array (or (L,N) for an array of rows)
+def thick_index(it, numthick, num_lay):
+    return np.array(np.unravel_index(it,(numthick,)*num_lay))
+
+
+#read the RMSE space of every shard in dr_save for the material sequences that match `materials`
+#materials gives the material of each layer, None for any material, e.g. (0,1,None) or (None,None,2)
+#returns (combos, thicks, rmse) with combos (C,L), thicks (T,) [m] and rmse (C,T**L,5) float32
+#only the finished sequences (in the manifest of their shard) are returned, with done_only=False the others are
+#returned too with NaN rows. Only the chunks of the selected finished sequences are read
+def load_rmse(dr_save, materials=None, done_only=True):
+    files = sorted(glob.glob(os.path.join(dr_save,'rmse_*of*.h5')))
+    if len(files) == 0:
+        raise IOError('no RMSE space files in %s'%dr_save)
+    combos = []
+    rmse = []
+    thicks = None
+    for filename in files:
+        (shard,num_shards) = map(int,re.match(r'rmse_(\d+)of(\d+)\.h5$',os.path.basename(filename)).groups())
+        done = read_manifest(manifest_name(dr_save, shard, num_shards))
+        with h5py.File(filename,'r') as f:
+            c = f['combos'][:].astype(np.int64)
+            thicks = f['thicks'][:]
+            sel = np.ones(c.shape[0],dtype=bool)
+            if materials is not None:
+                if len(materials) != c.shape[1]:
+                    raise ValueError('materials has %d layers, the space has %d'%(len(materials),c.shape[1]))
+                for q in range(c.shape[1]):
+                    if materials[q] is not None:
+                        sel &= c[:,q] == materials[q]
+            finished = np.array([combo_name(combo) in done for combo in c],dtype=bool)
+            if done_only:
+                sel &= finished
+            idx = np.nonzero(sel)[0]
+            combos.append(c[idx])
+            #files written before the NaN fill value hold zeros for the unfinished sequences
+            r = np.full((idx.size,)+f['rmse'].shape[1:],np.nan,dtype=np.float32)
+            for (j,i) in enumerate(idx):
+                if finished[i]:
+                    r[j] = f['rmse'][i]
+            rmse.append(r)
+    combos = np.concatenate(combos)
+    rmse = np.concatenate(rmse)
+    #same order as material_combos whatever the number of shards
+    order = np.lexsort(combos.T[::-1])
+    return (combos[order],thicks,rmse[order])
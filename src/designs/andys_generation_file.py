@@ -1,6 +1,8 @@
 # code to generate test examples for the CNN networks
-# Parallel calls to TMM code
-# -->saves the entire file in memory while processing: generation of ~500k structures on 16GB RAM is OK
+# Blocks of structures are evaluated by the multi-threaded TMM kernel
+# -->each block is appended to the file as soon as it is computed: memory use does not grow with set_length
+# -->each block has its own seed and is recorded in the file, an interrupted run resumes from the last finished block
+# -->each quantity is a separate compressed dataset, spectra as (N, angle, wavelength), see column_layout
 # arl92@case.edu 2021-01-22
 # please refer to copyright
 
@@ -15,9 +17,9 @@ import numpy as np
 import tables
 import matplotlib.pyplot as plt
 import datetime
+import os
 
 date = datetime.datetime.now()
-from joblib import Parallel, delayed
 import multiprocessing
 from tqdm import tqdm_notebook as tqdm
 
@@ -34,6 +36,7 @@ gl = di.nk_Cauchy_Urbach(wave, 1.55,
 void = np.ones(wave.size)  # vacuum
 
 materials = np.array([ag, al2o3, ito, ni, tio2])
+material_names = ['Ag', 'Al2O3', 'ITO', 'Ni', 'TiO2']  # names of the materials array, stored in the file
 
 #########################################################################################
 # System Parameters - What range of parameters are you searching?
@@ -48,8 +51,16 @@ n_super = void  # material to be used for superstrate
 n_subst = gl  # material to be used for substrate
 
 # parameters for generating random data set
-np.random.seed(35447)  # Seed the RNG for reproducability
-set_length = 200000  # Number of samples in data file (warning: make sure you have enough RAM!)
+seed = 35447  # Global seed, block b is generated from the seed (seed, b) for reproducability
+set_length = 200000  # Number of samples in data file
+block_size = 1000  # Number of structures evaluated per call to the TMM kernel, appended and recorded at once
+threads = multiprocessing.cpu_count()  # Number of threads used by the TMM kernel
+
+# storage of the data set
+column_layout = True  # one dataset per quantity (ang, mats, l, rp, rs, tp, ts, psi, delta), False for the single 'data' array of rows
+single_precision = True  # store floats as float32 instead of float64
+complib = 'zlib'  # compression library, 'zlib' (readable by any h5py) or 'blosc' (faster, h5py needs hdf5plugin), None for no compression
+chunk_rows = 256  # structures per chunk of each dataset in the column layout
 ###########################################################################################
 l = np.ones(num_lay).astype('double')
 ranges = np.array([min_thick, max_thick])
@@ -58,9 +69,12 @@ ranges = np.array([min_thick, max_thick])
 # saved as a txt file in the same folder, makes usage easier
 comments = 'Materials: Ag,Al2O3,ITO,Ni,TiO2. trange 1-60nm. Return [ang,mats,l, Rp, Rs, Tp, Ts, Ellipsometric] 25-45-65'
 # this filename is where the data will be saved
+# it does not depend on the date so that a restarted run finds the file it has to resume
+# the layout and precision are part of it, changing them writes a new file instead of resuming another one
 froot = 'data_rte+ni_gen' + str(l.size) + 'lay' + str(num_mat) + 'mat_' + str(
-    set_length) + 'n_v-tma_' + date.strftime("%Y") + date.strftime(
-    "%m") + date.strftime("%d")
+    set_length) + 'n_v-tma_s' + str(seed) + (
+        '_col' if column_layout else '_flat') + (
+            '_f32' if single_precision else '_f64')
 coms = open(froot + '_comments.txt', "w")
 coms.write(comments)
 coms.close()
@@ -68,76 +82,155 @@ coms.close()
 
 ################### GENERATION SCRIPT #######################
 
-def generate_fcn(wave, n_subst, n_super, materials, num_mat, ranges, ang, l):
-    n = np.zeros((l.size, wave.size), dtype=complex)
-    psi = np.zeros(wave.size * ang.size)
-    delta = np.zeros(wave.size * ang.size)
-    rp = np.zeros(wave.size * ang.size)
-    rs = np.zeros(wave.size * ang.size)
-    tp = np.zeros(wave.size * ang.size)
-    ts = np.zeros(wave.size * ang.size)
-    m = np.zeros((num_mat * l.size))
-
-    # create a random structure within the parameter space
-    for el in range(0, l.size):
+# create a random structure within the parameter space
+# rng is the random generator of the block the structure belongs to
+# returns the material index and thickness of each layer
+def random_structure(rng, num_mat, ranges, num_lay):
+    mats = np.zeros(num_lay, dtype=int)
+    l = np.zeros(num_lay)
+    for el in range(0, num_lay):
         # choose a random material from library
-        mat = np.random.randint(low=0, high=num_mat)
+        mat = rng.integers(low=0, high=num_mat)
         # do not allow subsequent layers to be the same material
         if el > 0:
             while mold == mat:
-                mat = np.random.randint(low=0, high=num_mat)
+                mat = rng.integers(low=0, high=num_mat)
         mold = mat
-        # assign material to layer
-        n[el, :] = materials[mat, :]
-        m[mat + num_mat * el] = 1
+        mats[el] = mat
 
         # choose layer thickness
-        l[el] = np.random.uniform(low=ranges[0], high=ranges[1])
-
-    # calculate output for all angles (flattened arrays)
+        l[el] = rng.uniform(low=ranges[0], high=ranges[1])
+    return (mats, l)
+
+
+# create a block of random structures and calculate their spectra
+# the whole block goes through the threaded TMM kernel in a single call
+def generate_block(wave, n_subst, n_super, materials, num_mat, ranges, ang,
+                   num_lay, block, rng):
+    mats = np.zeros((block, num_lay), dtype=int)
+    l = np.zeros((block, num_lay))
+    for g in range(block):
+        (mats[g], l[g]) = random_structure(rng, num_mat, ranges, num_lay)
+    # one-hot material labels, num_mat entries per layer
+    m = np.zeros((block, num_lay, num_mat))
+    m[np.arange(block)[:, np.newaxis], np.arange(num_lay), mats] = 1
+
+    # calculate output for all angles
     # set up to return reflectance, transmittance, and ellipsometric data for all structures
-    for j in range(0, ang.size):
-        for i in range(0, wave.size):
-            (psi[i + wave.size * j], delta[i + wave.size * j]) = tmm.ellips(
-                ang[j], wave[i], n[:, i], l, n_super[i], n_subst[i])
-            rp[i + wave.size * j] = tmm.reflect_amp(1, ang[j], wave[i],
-                                                    n[:, i], l, n_super[i],
-                                                    n_subst[i])
-            rs[i + wave.size * j] = tmm.reflect_amp(0, ang[j], wave[i],
-                                                    n[:, i], l, n_super[i],
-                                                    n_subst[i])
-            tp[i + wave.size * j] = tmm.trans_amp(1, ang[j], wave[i], n[:, i],
-                                                  l, n_super[i], n_subst[i])
-            ts[i + wave.size * j] = tmm.trans_amp(0, ang[j], wave[i], n[:, i],
-                                                  l, n_super[i], n_subst[i])
-    data_save = np.concatenate((ang, m, l, rp, rs, tp, tp, psi, delta),
-                               axis=None)
-    data_save = np.reshape(data_save, (1, data_save.size))
-    return data_save
-
-
-print('Generating Parallel Pool...\n')
-cores = multiprocessing.cpu_count()
-print('Parallel: %d Found Cores.\n' % (cores))
-print('Generating Data...\n')
-results = Parallel(n_jobs=cores)(
-    delayed(generate_fcn)(wave, n_subst, n_super, materials, num_mat, ranges,
-                          ang, l) for g in tqdm(range(set_length)))
-try:
-    filename = froot + '.h5'
+    (rp, rs, tp, ts, psi, delta) = tmm.spectra_batch_par(ang, wave,
+                                                         materials[mats], l,
+                                                         n_super, n_subst)
+    # one array per quantity, in the order of columns
+    return (np.tile(ang, (block, 1)), m, l, rp, rs, tp, ts, psi, delta)
+
+
+# quantities stored for each structure and their shape per structure
+columns = ['ang', 'mats', 'l', 'rp', 'rs', 'tp', 'ts', 'psi', 'delta']
+column_shapes = [(ang.size,), (num_lay, num_mat), (num_lay,)] + [
+    (ang.size, wave.size)] * 6
+
+
+# one row per structure for the flat layout, spectra flattened as [spec(ang1),spec(ang2),...]
+def flat_rows(data):
+    return np.concatenate([np.reshape(x, (x.shape[0], -1)) for x in data],
+                          axis=1)
+
+
+# iterate over the blocks of the data set, starting at block start
+# yields (block id, rows) one block at a time, so only a single block is held in memory
+# block b only depends on (seed, b): the data is the same whatever the number of threads or restarts
+def generate_blocks(wave, n_subst, n_super, materials, num_mat, ranges, ang,
+                    num_lay, set_length, block_size, seed, start=0):
+    for b in range(start, -(-set_length // block_size)):
+        rng = np.random.default_rng([seed, b])
+        yield (b, generate_block(wave, n_subst, n_super, materials, num_mat,
+                                 ranges, ang, num_lay,
+                                 min(block_size, set_length - b * block_size),
+                                 rng))
+
+
+print('Generating Thread Pool...\n')
+tmm.set_threads(threads)
+print('Parallel: %d Threads.\n' % (threads))
+filename = froot + '.h5'
+num_blocks = -(-set_length // block_size)
+layout = 'columns' if column_layout else 'flat'
+if os.path.exists(filename):
+    print('Resuming File: %s\n' % (filename))
+    f = tables.open_file(filename, mode='a')
+    # a file generated with other parameters cannot be continued
+    for (key, val) in (('seed', seed), ('set_length', set_length),
+                       ('block_size', block_size), ('layout', layout),
+                       ('wave', wave), ('ang', ang),
+                       ('materials', ','.join(material_names[:num_mat])),
+                       ('num_lay', num_lay), ('thick_range', ranges)):
+        saved = f.root._v_attrs[key]
+        if not np.array_equal(saved, val):
+            f.close()
+            raise ValueError('%s was generated with %s = %s, not %s' %
+                             (filename, key, saved, val))
+else:
     print('Opening File: %s\n' % (filename))
     f = tables.open_file(filename, mode='w')
-    atom = tables.Float64Atom()
-    wid = len(results[0][0])
-    shape = (0, wid)
-    array_c = f.create_earray(f.root, 'data', atom, shape)
-    print('Saving Data...\n')
-    for i in range(set_length):
-        array_c.append(np.reshape(results[i], (1, wid)))
+    if single_precision:
+        atom = tables.Float32Atom()
+    else:
+        atom = tables.Float64Atom()
+    filters = None
+    if complib is not None:
+        filters = tables.Filters(complevel=5, complib=complib, shuffle=True)
+    if column_layout:
+        for (name, shape) in zip(columns, column_shapes):
+            # the one-hot labels only take the values 0 and 1
+            col_atom = tables.UInt8Atom() if name == 'mats' else atom
+            f.create_earray(f.root, name, col_atom, (0,) + shape,
+                            filters=filters, chunkshape=(chunk_rows,) + shape,
+                            expectedrows=set_length)
+    else:
+        # [ang, mats, l, Rp, Rs, Tp, Ts, Psi, Delta]
+        wid = int(sum(np.prod(shape) for shape in column_shapes))
+        f.create_earray(f.root, 'data', atom, (0, wid), filters=filters,
+                        expectedrows=set_length)
+    # id of every block written, in order
+    f.create_earray(f.root, 'blocks', tables.Int64Atom(), (0,),
+                    expectedrows=num_blocks)
+    # description of the data set, readers do not need to know the generation parameters
+    attrs = f.root._v_attrs
+    attrs['seed'] = seed
+    attrs['set_length'] = set_length
+    attrs['block_size'] = block_size
+    attrs['layout'] = layout
+    # lists are stored as comma separated strings, readable without PyTables
+    attrs['columns'] = ','.join(columns)
+    attrs['wave'] = wave
+    attrs['ang'] = ang
+    attrs['materials'] = ','.join(material_names[:num_mat])
+    attrs['num_lay'] = num_lay
+    attrs['thick_range'] = ranges
+    attrs['comments'] = comments
+names = columns if column_layout else ['data']
+arrays = [f.get_node(f.root, name) for name in names]
+blocks = f.root.blocks
+try:
+    # blocks are written in order, so the finished ones are the first blocks.nrows
+    # rows of a block interrupted before it was recorded are dropped
+    start = blocks.nrows
+    for array_c in arrays:
+        array_c.truncate(min(start * block_size, set_length))
+    print('Generating Data: %d of %d blocks done.\n' % (start, num_blocks))
+    for (b, data) in tqdm(generate_blocks(wave, n_subst, n_super, materials,
+                                          num_mat, ranges, ang, l.size,
+                                          set_length, block_size, seed, start),
+                          total=num_blocks, initial=start):
+        if not column_layout:
+            data = [flat_rows(data)]
+        for (array_c, x) in zip(arrays, data):
+            array_c.append(x)
+        blocks.append([b])
+        f.flush()
     print('Closing File: %s\n' % (filename))
     f.close()
     print('Completed!')
-    del results
 except:
     f.close()
     print('Error in datasave!')